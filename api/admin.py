@@ -19,6 +19,7 @@ class ProjectAdmin(admin.ModelAdmin):
 
 class MessageAdmin(admin.ModelAdmin):
     search_fields = ["message_id", "subject", "sender"]
+    raw_id_fields = ["mbox_blob"]
 
 
 class ModuleAdmin(admin.ModelAdmin):
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+"""
+Full-text index of the subject and body of messages.
+
+The index is the api_message_fts table, which is not a Django model: on
+PostgreSQL it stores a tsvector for the subject and one for the body, each
+with a GIN index, while on SQLite it is an FTS5 virtual table whose rowid is
+the message id.  Rows are added when messages are imported and removed by a
+trigger when messages are deleted.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+# Long bodies are mostly patches, the beginning is enough to find them
+BODY_MAX_SIZE = 100000
+
+COLUMNS = ("subject", "body")
+
+
+def _clean(text):
+    # PostgreSQL does not accept NUL characters in text values
+    return (text or "").replace("\0", "")
+
+
+def index_messages(messages):
+    """Add @messages, a list of (message, body) pairs, to the index, or
+    update their entries if they are already indexed"""
+    rows = [
+        (m.id, _clean(m.subject), _clean(body[:BODY_MAX_SIZE] if body else ""))
+        for m, body in messages
+    ]
+    if not rows:
+        return
+    if connection.vendor == "postgresql":
+        sql = (
+            "INSERT INTO api_message_fts (message_id, subject, body) VALUES "
+            "(%s, to_tsvector('english', %s), to_tsvector('english', %s)) "
+            "ON CONFLICT (message_id) DO UPDATE "
+            "SET subject = EXCLUDED.subject, body = EXCLUDED.body"
+        )
+    else:
+        sql = (
+            "INSERT OR REPLACE INTO api_message_fts (rowid, subject, body) "
+            "VALUES (%s, %s, %s)"
+        )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def match(column, keyword):
+    """Return a subquery for the ids of the messages whose @column (one of
+    COLUMNS) contains all the words in @keyword, in any order.  Each word
+    can also be the prefix of a longer word."""
+    assert column in COLUMNS
+    words = re.findall(r"\w+", keyword)
+    if connection.vendor == "postgresql":
+        sql = "SELECT message_id FROM api_message_fts WHERE "
+        condition = "%s @@ to_tsquery('english', %%s)" % column
+        keyword = " & ".join("%s:*" % w for w in words)
+    else:
+        sql = "SELECT rowid FROM api_message_fts WHERE "
+        condition = "%s MATCH %%s" % column
+        keyword = " AND ".join('"%s"*' % w for w in words)
+    if not words:
+        return RawSQL(sql + "1 = 0", [])
+    return RawSQL(sql + condition, [keyword])
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from api.models import Message
+
+
+class Command(BaseCommand):
+    help = "Store the preview and diff-stat of messages that lack them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=Message.objects.BULK_QUERY_SIZE,
+            help="number of messages to update per query",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        q = (
+            Message.objects.filter(Q(preview__isnull=True) | Q(diff_stat__isnull=True))
+            .only("id", "topic_id", "mbox_blob")
+            .select_related("mbox_blob")
+        )
+        last_id = 0
+        total = 0
+        while True:
+            msgs = list(q.filter(id__gt=last_id).order_by("id")[:batch_size])
+            if not msgs:
+                break
+            for m in msgs:
+                m.fill_derived_data()
+            Message.objects.bulk_update(msgs, ["preview", "diff_stat"])
+            last_id = msgs[-1].id
+            total += len(msgs)
+            if options["verbosity"] >= 2:
+                self.stdout.write("%d messages updated" % total)
+        if options["verbosity"] >= 1:
+            self.stdout.write("%d messages updated" % total)
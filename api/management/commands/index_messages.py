@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from api import fts
+from api.models import Message
+
+
+class Command(BaseCommand):
+    help = "Add the subject and body of all messages to the full-text index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=Message.objects.BULK_QUERY_SIZE,
+            help="number of messages to index per query",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        q = Message.objects.only("id", "subject", "mbox_blob").select_related(
+            "mbox_blob"
+        )
+        last_id = 0
+        total = 0
+        while True:
+            msgs = list(q.filter(id__gt=last_id).order_by("id")[:batch_size])
+            if not msgs:
+                break
+            fts.index_messages([(m, m.get_mbox_obj().get_body()) for m in msgs])
+            last_id = msgs[-1].id
+            total += len(msgs)
+            if options["verbosity"] >= 2:
+                self.stdout.write("%d messages indexed" % total)
+        if options["verbosity"] >= 1:
+            self.stdout.write("%d messages indexed" % total)
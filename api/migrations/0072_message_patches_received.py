@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0071_auto_20220919_1251'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='patches_received',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-18 02:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0072_message_patches_received'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='series_head',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message'),
+        ),
+    ]
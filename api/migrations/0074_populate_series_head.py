@@ -0,0 +1,36 @@
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def series_head_fill(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    Project = apps.get_model("api", "Project")
+    for project_id in Project.objects.values_list("id", flat=True):
+        msgs = Message.objects.filter(project_id=project_id).values_list(
+            "id", "message_id", "in_reply_to", "topic_id"
+        )
+        by_msgid = dict((x[1], x) for x in msgs)
+        heads = {}
+        for m in by_msgid.values():
+            seen = set()
+            parent = by_msgid.get(m[2])
+            while parent and parent[3] is None and parent[1] not in seen:
+                seen.add(parent[1])
+                parent = by_msgid.get(parent[2])
+            if parent and parent[3] is not None and parent[0] != m[0]:
+                heads.setdefault(parent[0], []).append(m[0])
+        for head_id, ids in heads.items():
+            for i in range(0, len(ids), BATCH_SIZE):
+                Message.objects.filter(pk__in=ids[i : i + BATCH_SIZE]).update(
+                    series_head_id=head_id
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("api", "0073_message_series_head")]
+
+    operations = [
+        migrations.RunPython(series_head_fill, reverse_code=migrations.RunPython.noop)
+    ]
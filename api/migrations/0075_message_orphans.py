@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0074_populate_series_head'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(series_head__isnull=True), fields=['project', 'in_reply_to'], name='api_message_orphans'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0075_message_orphans'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='diff_stat',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='preview',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
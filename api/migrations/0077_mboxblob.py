@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 03:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0076_message_preview_diff_stat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MboxBlob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data_xz', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='mbox_bytes',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='mbox_blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='api.mboxblob'),
+        ),
+    ]
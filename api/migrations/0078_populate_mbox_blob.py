@@ -0,0 +1,60 @@
+import hashlib
+import lzma
+
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+# Same as MboxBlob.XZ_PRESET
+XZ_PRESET = 0
+
+
+def mbox_blob_fill(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    MboxBlob = apps.get_model("api", "MboxBlob")
+    last_id = 0
+    while True:
+        msgs = list(
+            Message.objects.filter(id__gt=last_id, mbox_blob=None)
+            .only("id", "mbox_bytes")
+            .order_by("id")[:BATCH_SIZE]
+        )
+        if not msgs:
+            break
+        blobs = {}
+        for m in msgs:
+            data = bytes(m.mbox_bytes)
+            digest = hashlib.sha256(data).hexdigest()
+            if digest not in blobs:
+                blobs[digest] = MboxBlob(
+                    sha256=digest, data_xz=lzma.compress(data, preset=XZ_PRESET)
+                )
+            m.mbox_blob_id = digest
+        MboxBlob.objects.bulk_create(blobs.values(), ignore_conflicts=True)
+        Message.objects.bulk_update(msgs, ["mbox_blob"])
+        last_id = msgs[-1].id
+
+
+def mbox_bytes_fill(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    last_id = 0
+    while True:
+        msgs = list(
+            Message.objects.filter(id__gt=last_id)
+            .select_related("mbox_blob")
+            .only("id", "mbox_blob")
+            .order_by("id")[:BATCH_SIZE]
+        )
+        if not msgs:
+            break
+        for m in msgs:
+            m.mbox_bytes = lzma.decompress(m.mbox_blob.data_xz)
+        Message.objects.bulk_update(msgs, ["mbox_bytes"])
+        last_id = msgs[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("api", "0077_mboxblob")]
+
+    operations = [migrations.RunPython(mbox_blob_fill, reverse_code=mbox_bytes_fill)]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 03:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0078_populate_mbox_blob'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='message',
+            name='mbox_bytes',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='mbox_blob',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='api.mboxblob'),
+        ),
+    ]
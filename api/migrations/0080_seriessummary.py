@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-18 03:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0079_message_mbox_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeriesSummary',
+            fields=[
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='api.message')),
+                ('git_status', models.CharField(blank=True, max_length=7, null=True)),
+                ('git_data', jsonfield.fields.JSONField(default={})),
+                ('testing_status', models.CharField(blank=True, max_length=7, null=True)),
+                ('obsoleted_by', models.CharField(blank=True, max_length=4096)),
+                ('obsoleted_by_subject', models.CharField(blank=True, max_length=4096)),
+            ],
+        ),
+    ]
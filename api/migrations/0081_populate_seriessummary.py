@@ -0,0 +1,64 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+# Same as summary_testing_status in api.models, frozen for this migration
+def summary_testing_status(statuses):
+    if not statuses:
+        return None
+    for status in ("failure", "running", "pending"):
+        if status in statuses:
+            return status
+    return "success"
+
+
+def seriessummary_fill(apps, schema_editor):
+    MessageResult = apps.get_model("api", "MessageResult")
+    Message = apps.get_model("api", "Message")
+    SeriesSummary = apps.get_model("api", "SeriesSummary")
+    summaries = {}
+
+    def get_summary(message_id):
+        if message_id not in summaries:
+            summaries[message_id] = SeriesSummary(message_id=message_id)
+        return summaries[message_id]
+
+    git = MessageResult.objects.filter(name="git", message__topic__isnull=False)
+    for message_id, status, data in git.values_list("message_id", "status", "data"):
+        s = get_summary(message_id)
+        s.git_status = status
+        s.git_data = data
+    testing = defaultdict(set)
+    for message_id, status in MessageResult.objects.filter(
+        name__startswith="testing.", message__topic__isnull=False
+    ).values_list("message_id", "status"):
+        testing[message_id].add(status)
+    for message_id, statuses in testing.items():
+        get_summary(message_id).testing_status = summary_testing_status(statuses)
+    obsolete = Message.objects.filter(
+        is_obsolete=True, topic__isnull=False, topic__latest__isnull=False
+    )
+    for message_id, latest_id, latest_subject in obsolete.values_list(
+        "id", "topic__latest__message_id", "topic__latest__subject"
+    ):
+        s = get_summary(message_id)
+        s.obsoleted_by = latest_id
+        s.obsoleted_by_subject = latest_subject
+    SeriesSummary.objects.bulk_create(summaries.values(), batch_size=BATCH_SIZE)
+
+
+def seriessummary_clear(apps, schema_editor):
+    SeriesSummary = apps.get_model("api", "SeriesSummary")
+    SeriesSummary.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("api", "0080_seriessummary")]
+
+    operations = [
+        migrations.RunPython(seriessummary_fill, reverse_code=seriessummary_clear)
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0081_populate_seriessummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seriessummary',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-18 04:07
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0082_seriessummary_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=32)),
+                ('timestamp', models.DateTimeField(default=datetime.datetime.utcnow)),
+                ('name', models.CharField(blank=True, max_length=256)),
+                ('message', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.message')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.project')),
+            ],
+            options={
+                'index_together': {('project', 'id')},
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations
+
+# Bodies are only available in the compressed mboxes, so this only indexes
+# the subjects; "manage.py index_messages" fills in the bodies
+
+POSTGRES_FORWARD = [
+    """CREATE TABLE api_message_fts (
+           message_id integer PRIMARY KEY,
+           subject tsvector NOT NULL,
+           body tsvector NOT NULL
+       )""",
+    "CREATE INDEX api_message_fts_subject ON api_message_fts USING gin(subject)",
+    "CREATE INDEX api_message_fts_body ON api_message_fts USING gin(body)",
+    """CREATE FUNCTION api_message_fts_delete() RETURNS trigger AS $$
+       BEGIN
+           DELETE FROM api_message_fts WHERE message_id = OLD.id;
+           RETURN OLD;
+       END
+       $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER api_message_fts_delete AFTER DELETE ON api_message
+       FOR EACH ROW EXECUTE PROCEDURE api_message_fts_delete()""",
+    """INSERT INTO api_message_fts (message_id, subject, body)
+       SELECT id, to_tsvector('english', subject), ''::tsvector FROM api_message""",
+    # Replaced by the stored vector
+    "DROP INDEX IF EXISTS api_message_subject_gin",
+]
+
+POSTGRES_REVERSE = [
+    "CREATE INDEX api_message_subject_gin ON api_message "
+    "USING gin(to_tsvector('english', subject::text))",
+    "DROP TRIGGER api_message_fts_delete ON api_message",
+    "DROP FUNCTION api_message_fts_delete()",
+    "DROP TABLE api_message_fts",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE api_message_fts USING fts5(subject, body)",
+    """CREATE TRIGGER api_message_fts_delete AFTER DELETE ON api_message
+       BEGIN
+           DELETE FROM api_message_fts WHERE rowid = OLD.id;
+       END""",
+    """INSERT INTO api_message_fts (rowid, subject, body)
+       SELECT id, subject, '' FROM api_message""",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER api_message_fts_delete",
+    "DROP TABLE api_message_fts",
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        for sql in statements[vendor]:
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("api", "0083_change")]
+
+    operations = [
+        migrations.RunPython(
+            run_sql({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}),
+            reverse_code=run_sql(
+                {"postgresql": POSTGRES_REVERSE, "sqlite": SQLITE_REVERSE}
+            ),
+        )
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.14 on 2026-10-18 04:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+import email.utils
+
+
+def populate_maintainers(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    Maintainer = apps.get_model("api", "Maintainer")
+    entries = []
+    for m in Message.objects.exclude(maintainers=[]).only("id", "maintainers"):
+        for entry in m.maintainers or []:
+            name, addr = email.utils.parseaddr(entry)
+            entries.append(
+                Maintainer(message=m, name=name[:256], email=addr.lower()[:256])
+            )
+    Maintainer.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0084_message_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Maintainer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256)),
+                ('email', models.CharField(max_length=256)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.message')),
+            ],
+            options={
+                'index_together': {('email', 'message'), ('name', 'message')},
+            },
+        ),
+        migrations.RunPython(populate_maintainers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+from api.migrations import PostgresOnlyMigration
+
+
+# "maint:NAME" looks for substrings of the name and email of the maintainers
+class Migration(PostgresOnlyMigration):
+
+    dependencies = [("api", "0085_maintainer")]
+
+    operations = [
+        migrations.RunSQL(
+            "create index api_maintainer_name_gin on api_maintainer using gin(upper(name) gin_trgm_ops);",
+            "drop index api_maintainer_name_gin",
+        ),
+        migrations.RunSQL(
+            "create index api_maintainer_email_gin on api_maintainer using gin(upper(email) gin_trgm_ops);",
+            "drop index api_maintainer_email_gin",
+        ),
+    ]
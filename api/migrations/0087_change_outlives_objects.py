@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-18 05:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0086_postgres_maintainer_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='change',
+            name='msgid',
+            field=models.CharField(blank=True, max_length=4096),
+        ),
+        migrations.AlterField(
+            model_name='change',
+            name='message',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message'),
+        ),
+        migrations.AlterField(
+            model_name='change',
+            name='project',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.project'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def change_msgid_fill(apps, schema_editor):
+    Change = apps.get_model("api", "Change")
+    Message = apps.get_model("api", "Message")
+    Change.objects.filter(message__isnull=False).update(
+        msgid=Subquery(
+            Message.objects.filter(id=OuterRef("message_id")).values("message_id")
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("api", "0087_change_outlives_objects")]
+
+    operations = [
+        migrations.RunPython(change_msgid_fill, reverse_code=migrations.RunPython.noop)
+    ]
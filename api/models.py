@@ -9,12 +9,18 @@
 # http://opensource.org/licenses/MIT.
 import datetime
 import email
+import email.utils
+import hashlib
 import quopri
 import re
+import time
 
 from django.core import validators
-from django.db import models
-from django.db.models import Q
+from django.core.cache import caches
+from django.db import connection, models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.urls import reverse
 import jsonfield
@@ -22,9 +28,11 @@ import lzma
 
 from mbox import MboxMessage, decode_payload
 from patchew.tags import lines_iter
-from event import emit_event, declare_event
+from event import emit_event, declare_event, register_handler
 import mod
 
+from . import fts
+
 
 class LogEntry(models.Model):
     data_xz = models.BinaryField()
@@ -41,6 +49,93 @@ class LogEntry(models.Model):
         self.data_xz = lzma.compress(value.encode("utf-8"))
 
 
+class MboxBlobManager(models.Manager):
+    # Keep the number of parameters in "IN" lookups below SQLite's limit
+    BULK_QUERY_SIZE = 500
+
+    def _lock(self, digests):
+        """Lock the rows of the blobs in @digests until the end of the
+        transaction; return the digests that were found"""
+        digests = list(digests)
+        found = []
+        for i in range(0, len(digests), self.BULK_QUERY_SIZE):
+            chunk = digests[i : i + self.BULK_QUERY_SIZE]
+            q = self.select_for_update().filter(pk__in=chunk)
+            found += q.values_list("pk", flat=True)
+        return found
+
+    def store(self, blobs):
+        """Save @blobs, skipping those whose contents are already there.
+        The rows stay locked until the end of the caller's transaction,
+        so that delete_unused cannot remove them before the messages that
+        refer to them are saved."""
+        blobs = {x.sha256: x for x in blobs}
+        with transaction.atomic():
+            while blobs:
+                self.bulk_create(
+                    blobs.values(),
+                    batch_size=self.BULK_QUERY_SIZE,
+                    ignore_conflicts=True,
+                )
+                # A blob that already existed could have been deleted
+                # after the insert was skipped; insert it again
+                for digest in self._lock(blobs):
+                    del blobs[digest]
+
+    def delete_unused(self, digests=None):
+        """Delete the blobs in @digests, or all blobs if @digests is None,
+        that no message refers to anymore"""
+        if digests is None:
+            digests = self.filter(message__isnull=True).values_list("pk", flat=True)
+        with transaction.atomic():
+            # Wait for the transactions that are saving messages with
+            # these blobs, see store()
+            digests = self._lock(digests)
+            for i in range(0, len(digests), self.BULK_QUERY_SIZE):
+                chunk = digests[i : i + self.BULK_QUERY_SIZE]
+                self.filter(pk__in=chunk, message__isnull=True).delete()
+
+
+class MboxBlob(models.Model):
+    """Compressed mbox of a message.  Blobs are addressed by the SHA-256
+    of their uncompressed contents, so that the copies of a message that
+    was sent to several projects share the same blob."""
+
+    # Messages are small, and the fastest preset compresses them about as
+    # well as the default one
+    XZ_PRESET = 0
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    data_xz = models.BinaryField()
+
+    objects = MboxBlobManager()
+
+    @classmethod
+    def from_bytes(cls, data):
+        blob = cls(
+            sha256=hashlib.sha256(data).hexdigest(),
+            data_xz=lzma.compress(data, preset=cls.XZ_PRESET),
+        )
+        blob._data = data
+        return blob
+
+    @property
+    def data(self):
+        if not hasattr(self, "_data"):
+            self._data = lzma.decompress(self.data_xz)
+        return self._data
+
+    def iter_data(self, chunk_size=64 * 1024):
+        """Yield the uncompressed contents a piece at a time"""
+        if hasattr(self, "_data"):
+            yield self._data
+            return
+        decompressor = lzma.LZMADecompressor()
+        data_xz = memoryview(self.data_xz)
+        for i in range(0, len(data_xz), chunk_size):
+            yield decompressor.decompress(data_xz[i : i + chunk_size])
+
+
 class Result(models.Model):
     PENDING = "pending"
     SUCCESS = "success"
@@ -214,6 +309,7 @@ class Project(models.Model):
         old_project = Project.objects.filter(pk=self.pk).first()
         old_config = old_project.config if old_project else None
         super().save(*args, **kwargs)
+        ProjectRoutingIndex.invalidate()
         if old_config != self.config:
             emit_event("SetProjectConfig", obj=self)
 
@@ -269,35 +365,47 @@ class Project(models.Model):
         r = self.mailing_list.split()
         return [x.rstrip(",;") for x in r]
 
+    def get_prefix_matcher(self):
+        """Return a function that tests if a list of subject prefixes
+        satisfies the project's prefix_tags"""
+        rules = []
+        for t in self.prefix_tags.split():
+            inversed = t.startswith("!")
+            if inversed:
+                t = t[1:]
+            if t.startswith("/"):
+                test = re.compile(t[1:]).match
+            else:
+                t = t.lower()
+                test = lambda p, t=t: t == p.lower()
+            rules.append((test, inversed))
+
+        def matcher(prefixes):
+            for test, inversed in rules:
+                # A tag led by "!" must not be found, any other tag must be
+                if any(test(p) for p in prefixes) == inversed:
+                    return False
+            return True
+
+        return matcher
+
     def recognizes(self, m):
         """Test if @m is considered a message in this project"""
-        addr_ok = False
+        mailing_lists = self.get_mailing_lists()
         for name, addr in m.get_to() + m.get_cc():
-            if addr in self.get_mailing_lists():
-                addr_ok = True
-                break
-        if addr_ok:
-            for t in self.prefix_tags.split():
-                found = False
-                if t.startswith("!"):
-                    t = t[1:]
-                    inversed = True
-                else:
-                    inversed = False
-                for p in m.get_prefixes():
-                    if t.startswith("/"):
-                        found = re.match(t[1:], p)
-                    else:
-                        found = t.lower() == p.lower()
-                    if found:
-                        if inversed:
-                            return False
-                        break
-                if not found and not inversed:
-                    return False
-            return True
+            if addr in mailing_lists:
+                return self.get_prefix_matcher()(m.get_prefixes())
         return False
 
+    @classmethod
+    def find_projects_for_message(cls, m):
+        """Return the projects that recognize @m, using the routing index"""
+        ids = ProjectRoutingIndex.get().find_project_ids(m)
+        if not ids:
+            return []
+        projects = cls.objects.in_bulk(ids)
+        return [projects[i] for i in ids if i in projects]
+
     def get_subprojects(self):
         return Project.objects.filter(parent_project=self)
 
@@ -360,6 +468,59 @@ class Project(models.Model):
         return ProjectResult.objects.filter(project=self)
 
 
+@receiver(post_delete, sender=Project)
+def _project_deleted(sender, instance, **kwargs):
+    ProjectRoutingIndex.invalidate()
+    # The messages of the project were deleted in cascade, which leaves
+    # their blobs behind
+    MboxBlob.objects.delete_unused()
+    emit_event("ProjectDeleted", project=instance)
+
+
+class ProjectRoutingIndex:
+    """Process-wide index used to find the projects of incoming messages.
+
+    Projects are looked up by mailing list address and their prefix tags
+    are compiled only once, so that routing a message costs O(recipients)
+    rather than a Project.recognizes() call for every project.  The index
+    only stores project ids, so that callers always get fresh objects.
+
+    Saving a project drops the index of the current process; other processes
+    pick up the change when their index expires after MAX_AGE seconds."""
+
+    MAX_AGE = 60
+
+    _current = None
+
+    def __init__(self):
+        self.created = time.monotonic()
+        self.by_address = {}
+        for order, p in enumerate(Project.objects.order_by("id")):
+            entry = (order, p.id, p.get_prefix_matcher())
+            for addr in set(p.get_mailing_lists()):
+                self.by_address.setdefault(addr, []).append(entry)
+
+    @classmethod
+    def get(cls):
+        index = cls._current
+        if index is None or time.monotonic() - index.created > cls.MAX_AGE:
+            index = cls._current = cls()
+        return index
+
+    @classmethod
+    def invalidate(cls):
+        cls._current = None
+
+    def find_project_ids(self, m):
+        candidates = set()
+        for name, addr in m.get_to() + m.get_cc():
+            candidates.update(self.by_address.get(addr, ()))
+        if not candidates:
+            return []
+        prefixes = m.get_prefixes()
+        return [pid for order, pid, matcher in sorted(candidates) if matcher(prefixes)]
+
+
 class ProjectResult(Result):
     @property
     def obj(self):
@@ -389,7 +550,19 @@ declare_event(
     series="series instance that is marked complete",
 )
 
-declare_event("MessageAdded", message="message object that is added")
+declare_event(
+    "MessageAdded",
+    message="message object that is added",
+    batch="True if the message comes from a batch import, in which case "
+    "series bookkeeping is done once per series by SeriesImported",
+)
+declare_event(
+    "SeriesImported",
+    series="series instance that received new messages in a batch import",
+)
+declare_event("MessageDeleted", message="message object that was deleted")
+declare_event("MaintainersUpdate", series="series whose maintainers were updated")
+declare_event("ProjectDeleted", project="project object that was deleted")
 
 
 declare_event("SetProjectConfig", obj="project whose configuration was updated")
@@ -441,6 +614,27 @@ class MessageManager(models.Manager):
             q = self.get_queryset()
         return q.filter(topic__isnull=False).prefetch_related("project")
 
+    # Columns that pages listing series do not show; "properties" and
+    # "maintainers" are still loaded because the status hooks look at them
+    LIST_DEFERRED_FIELDS = (
+        "recipients",
+        "tags",
+        "preview",
+        "diff_stat",
+        "patches_received",
+    )
+
+    def series_list(self, queryset=None, keep=()):
+        """Restrict @queryset (by default, all series heads) to the columns
+        needed to list series, and fetch the project, topic and summary in
+        the same query.  The columns in @keep are loaded even if lists
+        usually do not need them; other deferred columns are loaded on
+        access."""
+        if queryset is None:
+            queryset = self.series_heads()
+        deferred = [f for f in self.LIST_DEFERRED_FIELDS if f not in keep]
+        return queryset.defer(*deferred).select_related("project", "topic", "summary")
+
     def find_series(self, message_id, project=None):
         heads = self.series_heads(project)
         if heads is None:
@@ -466,38 +660,170 @@ class MessageManager(models.Manager):
     def patches(self):
         return self.get_queryset().filter(is_patch=True)
 
-    def update_series(self, msg):
-        """Update the series' record to which @msg is replying"""
+    def update_series(self, msg, adopted=[]):
+        """Update the series' record to which @msg is replying; @adopted
+        are the earlier replies that were attached to the thread by @msg"""
         s = msg.get_series_head()
         if not s:
             return
-        if not s.last_reply_date or s.last_reply_date < msg.date:
-            s.last_reply_date = msg.date
-            s.save()
-        if s.get_sender_addr() != msg.get_sender_addr() and (
-            not s.last_comment_date or s.last_comment_date < msg.date
-        ):
-            s.last_comment_date = msg.date
-            s.save()
-        s.refresh_num_patches()
-        cur, total = s.get_num()
-        if cur == total and s.is_patch:
-            s.set_complete()
-            return
-        # TODO: Handle no cover letter case
-        find = set(range(1, total + 1))
-        for p in s.get_patches():
-            assert p.is_patch
-            cur, total = p.get_num()
-            if cur in find:
-                find.remove(cur)
-        if not find:
+        self.update_series_head(s, [msg] + adopted)
+
+    def update_series_head(self, s, msgs):
+        """Update the record of series @s after @msgs were added to it"""
+        update_fields = set()
+        for msg in msgs:
+            if not s.last_reply_date or s.last_reply_date < msg.date:
+                s.last_reply_date = msg.date
+                update_fields.add("last_reply_date")
+            if s.get_sender_addr() != msg.get_sender_addr() and (
+                not s.last_comment_date or s.last_comment_date < msg.date
+            ):
+                s.last_comment_date = msg.date
+                update_fields.add("last_comment_date")
+
+        patches = [
+            msg for msg in msgs if msg.is_patch and msg.in_reply_to == s.message_id
+        ]
+        with transaction.atomic():
+            if s.patches_received is None:
+                # First time we see the head (possibly after some of the
+                # patches), look at what is already in the database.  This
+                # includes @msgs.
+                s.refresh_num_patches(save=False)
+                update_fields.update(["num_patches", "patches_received"])
+            elif patches:
+                # Patches of the same series can be imported concurrently
+                locked = (
+                    Message.objects.select_for_update()
+                    .only("patches_received")
+                    .get(pk=s.pk)
+                )
+                s.patches_received = locked.patches_received
+                for msg in patches:
+                    s.add_received_patch(msg.patch_num)
+                update_fields.update(["num_patches", "patches_received"])
+
+            # Replies that are not patches only touch the dates
+            if update_fields:
+                s.save(update_fields=update_fields)
+        if not s.is_complete and s.has_all_patches():
             s.set_complete()
+        SeriesSummary.objects.bump_version([s])
+
+    def delete_messages(self, msgs):
+        """Delete @msgs, record the deletions and drop the blobs that are
+        not used anymore"""
+        msgs = list(msgs)
+        ids = [m.id for m in msgs]
+        for i in range(0, len(ids), self.BULK_QUERY_SIZE):
+            self.filter(pk__in=ids[i : i + self.BULK_QUERY_SIZE]).delete()
+        for m in msgs:
+            emit_event("MessageDeleted", message=m)
+        MboxBlob.objects.delete_unused(set(m.mbox_blob_id for m in msgs))
 
     def delete_subthread(self, msg):
-        for r in msg.get_replies():
-            self.delete_subthread(r)
-        msg.delete()
+        head = msg.get_series_head()
+        deleted = {}
+        pending = [msg]
+        if not head:
+            while pending:
+                m = pending.pop()
+                if m.id not in deleted:
+                    deleted[m.id] = m
+                    pending += m.get_replies()
+            self.delete_messages(deleted.values())
+            return
+        replies = head.get_thread_replies()
+        while pending:
+            m = pending.pop()
+            if m.id not in deleted:
+                deleted[m.id] = m
+                pending += replies.get(m.message_id, [])
+        self.delete_messages(deleted.values())
+        if head.id not in deleted:
+            SeriesSummary.objects.bump_version([head])
+
+    def _find_thread_head_id(self, msg, batch=None):
+        """Return the id of the nearest series head above @msg in its
+        thread, looking for the parents in @batch (a dictionary indexed
+        by project id and message id) before going to the database"""
+        seen = set()
+        m = msg
+        while m.in_reply_to and m.in_reply_to not in seen:
+            seen.add(m.in_reply_to)
+            key = (m.project_id, m.in_reply_to)
+            if batch and key in batch:
+                m = batch[key]
+            else:
+                m = (
+                    self.filter(project_id=m.project_id, message_id=m.in_reply_to)
+                    .only("topic", "series_head")
+                    .first()
+                )
+                if not m:
+                    return None
+                return m.id if m.is_series_head else m.series_head_id
+            if m.is_series_head:
+                return m.id
+        return None
+
+    def _save_in_thread(self, msg):
+        """Save @msg and link it into its thread.  Returns the replies that
+        were waiting for it, like _adopt_replies"""
+        msg.series_head_id = self._find_thread_head_id(msg)
+        msg.save()
+        if not msg.series_head_id and msg.in_reply_to:
+            # The parent could have been added concurrently, after the
+            # lookup above but too early to see @msg in _adopt_replies
+            head_id = self._find_thread_head_id(msg)
+            if head_id:
+                self._set_series_head([msg.id], head_id)
+                msg.series_head_id = head_id
+        return self._adopt_replies([msg])
+
+    def _adopt_replies(self, msgs):
+        """Attach to their thread the messages that were received before
+        their parent, now that @msgs have been added to the database.
+        Returns the adopted messages, except for series heads, so that
+        the caller can update their series."""
+        result = []
+        frontier = {}
+        for msg in msgs:
+            head_id = msg.id if msg.is_series_head else msg.series_head_id
+            if head_id:
+                frontier[(msg.project_id, msg.message_id)] = head_id
+        while frontier:
+            by_project = {}
+            for project_id, message_id in frontier:
+                by_project.setdefault(project_id, []).append(message_id)
+            adopted = {}
+            next_frontier = {}
+            for project_id, message_ids in by_project.items():
+                for i in range(0, len(message_ids), self.BULK_QUERY_SIZE):
+                    chunk = message_ids[i : i + self.BULK_QUERY_SIZE]
+                    for m in self.filter(
+                        project_id=project_id,
+                        in_reply_to__in=chunk,
+                        series_head__isnull=True,
+                    ):
+                        head_id = frontier[(project_id, m.in_reply_to)]
+                        if m.id == head_id:
+                            continue
+                        adopted.setdefault(head_id, []).append(m.id)
+                        # The replies to a series head belong to that series
+                        if not m.is_series_head:
+                            m.series_head_id = head_id
+                            result.append(m)
+                            next_frontier[(project_id, m.message_id)] = head_id
+            for head_id, ids in adopted.items():
+                self._set_series_head(ids, head_id)
+            frontier = next_frontier
+        return result
+
+    def _set_series_head(self, ids, head_id):
+        for i in range(0, len(ids), self.BULK_QUERY_SIZE):
+            chunk = ids[i : i + self.BULK_QUERY_SIZE]
+            self.filter(pk__in=chunk).update(series_head_id=head_id)
 
     def create(self, project, **validated_data):
         mbox = validated_data.pop("mbox")
@@ -519,52 +845,190 @@ class MessageManager(models.Manager):
         msg.is_patch = m.is_patch()
         msg.patch_num = m.get_num()[0]
         msg.project = project
-        msg.mbox_bytes = mbox.encode("utf-8")
-        msg.save()
+        with transaction.atomic():
+            msg.store_mbox(mbox.encode("utf-8"), m)
+            adopted = self._save_in_thread(msg)
+        fts.index_messages([(msg, m.get_body())])
         emit_event("MessageAdded", message=msg)
-        self.update_series(msg)
+        self.update_series(msg, adopted)
         return msg
 
-    def add_message_from_mbox(self, mbox, user, project_name=None):
-        def find_message_projects(m):
-            return [p for p in Project.objects.all() if p.recognizes(m)]
+    def _message_from_mbox(self, m, mbox_blob, project, topic=None):
+        msg = Message(
+            project=project,
+            message_id=m.get_message_id(),
+            in_reply_to=m.get_in_reply_to() or "",
+            date=m.get_date(),
+            subject=m.get_subject(),
+            stripped_subject=m.get_subject(strip_tags=True),
+            version=m.get_version(),
+            sender=m.get_from(),
+            recipients=m.get_to() + m.get_cc(),
+            prefixes=m.get_prefixes(),
+            topic=topic,
+            is_patch=m.is_patch(),
+            patch_num=m.get_num()[0],
+            mbox_blob=mbox_blob,
+        )
+        msg.fill_derived_data(m)
+        return msg
 
+    def add_message_from_mbox(self, mbox, user, project_name=None):
         m = MboxMessage(mbox)
         msgid = m.get_message_id()
         if project_name:
             projects = [Project.object.get(name=project_name)]
         else:
-            projects = find_message_projects(m)
+            projects = Project.find_projects_for_message(m)
         stripped_subject = m.get_subject(strip_tags=True)
         is_series_head = m.is_series_head()
+        mbox_blob = MboxBlob.from_bytes(mbox.encode("utf-8"))
         for p in projects:
-            msg = Message(
-                message_id=msgid,
-                in_reply_to=m.get_in_reply_to() or "",
-                date=m.get_date(),
-                subject=m.get_subject(),
-                stripped_subject=stripped_subject,
-                version=m.get_version(),
-                sender=m.get_from(),
-                recipients=m.get_to() + m.get_cc(),
-                prefixes=m.get_prefixes(),
+            msg = self._message_from_mbox(
+                m,
+                mbox_blob,
+                p,
                 topic=(
                     Topic.objects.for_stripped_subject(stripped_subject)
                     if is_series_head
                     else None
                 ),
-                is_patch=m.is_patch(),
-                patch_num=m.get_num()[0],
             )
-            msg.project = p
             if self.filter(message_id=msgid, project__name=p.name).first():
                 raise self.DuplicateMessageError(msgid)
-            msg.mbox_bytes = mbox.encode("utf-8")
-            msg.save()
+            with transaction.atomic():
+                MboxBlob.objects.store([mbox_blob])
+                adopted = self._save_in_thread(msg)
+            fts.index_messages([(msg, m.get_body())])
             emit_event("MessageAdded", message=msg)
-            self.update_series(msg)
+            self.update_series(msg, adopted)
         return projects
 
+    # Keep the number of parameters in "IN" lookups below SQLite's limit
+    BULK_QUERY_SIZE = 500
+
+    def _filter_message_ids(self, message_ids, **kwargs):
+        message_ids = list(message_ids)
+        for i in range(0, len(message_ids), self.BULK_QUERY_SIZE):
+            chunk = message_ids[i : i + self.BULK_QUERY_SIZE]
+            yield from self.filter(message_id__in=chunk, **kwargs)
+
+    def add_messages_from_mboxes(self, mboxes, filter_projects=None):
+        """Import a batch of messages in a single transaction.
+
+        All messages are parsed once, routed to projects with the routing
+        index and inserted with bulk_create.  MessageAdded is emitted for every
+        new message, but the series bookkeeping runs once per affected
+        series.  If given, @filter_projects receives the list of projects
+        that recognize a message and returns those that it should be
+        added to.  Returns the list of added messages."""
+        index = ProjectRoutingIndex.get()
+        routed = []
+        for mbox in mboxes:
+            m = MboxMessage(mbox)
+            # Messages without these headers would fail to insert
+            if not m.get_message_id() or not m.get_date():
+                continue
+            routed.append((m, mbox, index.find_project_ids(m)))
+
+        all_projects = Project.objects.in_bulk(
+            set(pid for m, mbox, ids in routed for pid in ids)
+        )
+        parsed = []
+        for m, mbox, ids in routed:
+            projects = [all_projects[pid] for pid in ids if pid in all_projects]
+            if filter_projects:
+                projects = filter_projects(projects)
+            if projects:
+                parsed.append((m, mbox, projects))
+
+        known = set(
+            (x.project_id, x.message_id)
+            for x in self._filter_message_ids(
+                set(m.get_message_id() for m, mbox, projects in parsed)
+            )
+        )
+        topics = {}
+        blobs = {}
+        new_messages = []
+        for m, mbox, projects in parsed:
+            stripped_subject = m.get_subject(strip_tags=True)
+            topic = None
+            if m.is_series_head():
+                if stripped_subject not in topics:
+                    topics[stripped_subject] = Topic.objects.for_stripped_subject(
+                        stripped_subject
+                    )
+                topic = topics[stripped_subject]
+            mbox_blob = None
+            for p in projects:
+                key = (p.id, m.get_message_id())
+                if key in known:
+                    continue
+                known.add(key)
+                if mbox_blob is None:
+                    mbox_blob = MboxBlob.from_bytes(mbox.encode("utf-8"))
+                    mbox_blob = blobs.setdefault(mbox_blob.sha256, mbox_blob)
+                new_messages.append(self._message_from_mbox(m, mbox_blob, p, topic))
+        if not new_messages:
+            return []
+
+        with transaction.atomic():
+            MboxBlob.objects.store(blobs.values())
+            self.bulk_create(new_messages, batch_size=self.BULK_QUERY_SIZE)
+
+            # bulk_create does not fill in the primary key on all databases,
+            # so fetch the new rows back
+            new_keys = set((x.project_id, x.message_id) for x in new_messages)
+            added = [
+                x
+                for x in self._filter_message_ids(
+                    set(x.message_id for x in new_messages),
+                    project__in=set(x.project_id for x in new_messages),
+                )
+                if (x.project_id, x.message_id) in new_keys
+            ]
+            added.sort(key=lambda x: x.date)
+            by_message_id = dict(
+                (m.get_message_id(), m) for m, mbox, projects in parsed
+            )
+            fts.index_messages(
+                [(x, by_message_id[x.message_id].get_body()) for x in added]
+            )
+
+            # Link the thread, following in_reply_to inside the batch
+            # before going to the database
+            by_key = dict(((x.project_id, x.message_id), x) for x in added)
+            linked = {}
+            for msg in added:
+                msg.series_head_id = self._find_thread_head_id(msg, by_key)
+                if msg.series_head_id:
+                    linked.setdefault(msg.series_head_id, []).append(msg.id)
+            for head_id, ids in linked.items():
+                self._set_series_head(ids, head_id)
+            adopted = self._adopt_replies(added)
+
+            by_id = dict((x.id, x) for x in added)
+            heads = self.in_bulk(
+                set(x.series_head_id for x in added + adopted if x.series_head_id)
+                - set(by_id.keys())
+            )
+            heads.update(by_id)
+            series = {}
+            for msg in added:
+                emit_event("MessageAdded", message=msg, batch=True)
+                s = msg if msg.is_series_head else heads.get(msg.series_head_id)
+                if s:
+                    series.setdefault(s.id, (s, []))[1].append(msg)
+            for msg in adopted:
+                s = heads[msg.series_head_id]
+                series.setdefault(s.id, (s, []))[1].append(msg)
+
+            for s, msgs in series.values():
+                emit_event("SeriesImported", series=s)
+                self.update_series_head(s, msgs)
+        return added
+
 
 def HeaderFieldModel(**args):
     return models.CharField(max_length=4096, **args)
@@ -596,6 +1060,44 @@ class QueuedSeries(models.Model):
         )
 
 
+class MaintainerManager(models.Manager):
+    def update_series(self, series):
+        """Replace the entries of @series with the contents of its
+        "maintainers" field."""
+        with transaction.atomic():
+            self.filter(message=series).delete()
+            self.bulk_create(
+                [Maintainer.from_entry(series, x) for x in series.maintainers or []]
+            )
+        emit_event("MaintainersUpdate", series=series)
+
+
+class Maintainer(models.Model):
+    """A maintainer of a series, as computed by the applier.  This is the
+    same information as Message.maintainers, but in a form that searches
+    can look up through an index."""
+
+    # The series head
+    message = models.ForeignKey("Message", on_delete=models.CASCADE)
+    name = models.CharField(max_length=256)
+    # Lowercase, so that "maint:me" can use the index
+    email = models.CharField(max_length=256)
+
+    objects = MaintainerManager()
+
+    @classmethod
+    def from_entry(cls, series, entry):
+        # The applier sends "First Last <email@address.com>" entries
+        name, addr = email.utils.parseaddr(entry)
+        return cls(message=series, name=name[:256], email=addr.lower()[:256])
+
+    class Meta:
+        index_together = [("email", "message"), ("name", "message")]
+
+    def __str__(self):
+        return "%s <%s>" % (self.name, self.email)
+
+
 class TopicManager(models.Manager):
     def for_stripped_subject(self, stripped_subject):
         q = (
@@ -660,7 +1162,7 @@ class Message(models.Model):
     is_obsolete = models.BooleanField(default=False)
     is_tested = models.BooleanField(default=False)
     is_reviewed = models.BooleanField(default=False)
-    mbox_bytes = models.BinaryField()
+    mbox_blob = models.ForeignKey(MboxBlob, on_delete=models.PROTECT)
 
     # is series head if not Null
     topic = models.ForeignKey(
@@ -670,9 +1172,25 @@ class Message(models.Model):
     # patch index number if is_patch
     patch_num = models.PositiveSmallIntegerField(null=True, blank=True)
 
+    # nearest series head above this message in the thread, if any; for
+    # series heads, this is the series that they were sent in reply to
+    series_head = models.ForeignKey(
+        "self", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
     # number of patches we've got if series head (non-null topic)
     num_patches = models.IntegerField(null=False, default=-1, blank=True)
 
+    # bitmap of the patch numbers we've got if series head; NULL until
+    # the patches are first counted
+    patches_received = models.BinaryField(null=True, blank=True)
+
+    # derived from the body when the message is imported, so that pages
+    # do not have to parse it; NULL if not computed yet (see the
+    # backfill_message_data command)
+    preview = models.TextField(null=True, blank=True)
+    diff_stat = models.TextField(null=True, blank=True)
+
     queues = models.ManyToManyField(User, blank=True, through=QueuedSeries)
 
     objects = MessageManager()
@@ -685,6 +1203,25 @@ class Message(models.Model):
             self._mbox_obj = MboxMessage(self.mbox)
         return self._mbox_obj
 
+    def get_mbox_bytes(self):
+        return self.mbox_blob.data
+
+    mbox_bytes = property(get_mbox_bytes)
+
+    def store_mbox(self, data, m=None):
+        """Store @data as the contents of the message and recompute the
+        columns derived from it.  @m is the already parsed MboxMessage,
+        if any."""
+        blob = MboxBlob.from_bytes(data)
+        MboxBlob.objects.store([blob])
+        self.mbox_blob = blob
+        # Parsed data and derived columns refer to the old contents
+        for attr in ("_mbox_obj", "_mbox_decoded", "_cached_data"):
+            self.__dict__.pop(attr, None)
+        if m is not None:
+            self._mbox_obj = m
+        self.fill_derived_data()
+
     def get_mbox(self):
         if not hasattr(self, "_mbox_decoded"):
             self._mbox_decoded = str(self.mbox_bytes, "utf-8")
@@ -748,6 +1285,7 @@ class Message(models.Model):
             messages = [self]
             series_tags = set()
 
+        models.prefetch_related_objects(messages, "mbox_blob")
         mbox_list = []
         for message in messages:
             mbox_list.append(message._get_mbox_with_tags(series_tags))
@@ -756,6 +1294,20 @@ class Message(models.Model):
     def get_mbox_with_tags(self):
         return b"\n".join(self.get_mboxes_with_tags())
 
+    def get_mbox_etag(self):
+        """Return an entity tag for get_mbox_with_tags.  The message itself
+        never changes, while its tags and the patches of the series only
+        change together with the version of the series summary"""
+        if self.is_series_head:
+            version = self.get_summary().version
+        else:
+            version = (
+                SeriesSummary.objects.filter(message_id=self.series_head_id)
+                .values_list("version", flat=True)
+                .first()
+            )
+        return "mbox-%s-%d" % (self.mbox_blob_id, version or 0)
+
     def get_num(self):
         assert self.is_patch or self.is_series_head
         cur, total = 1, 1
@@ -793,12 +1345,34 @@ class Message(models.Model):
         return self.topic_id is not None
 
     def get_series_head(self):
-        s = self
-        while s:
-            if s.is_series_head:
-                return s
-            s = s.get_in_reply_to_message()
-        return None
+        if self.is_series_head:
+            return self
+        return self.series_head
+
+    def get_thread_messages(self):
+        """Return all the messages in the thread of series head @self,
+        including other series that were sent in reply to it"""
+        assert self.is_series_head
+        result = []
+        seen = set([self.id])
+        heads = [self.id]
+        while heads:
+            msgs = Message.objects.filter(series_head_id__in=heads).order_by(
+                "patch_num", "id"
+            )
+            msgs = [m for m in msgs if m.id not in seen]
+            seen.update(m.id for m in msgs)
+            result += msgs
+            heads = [m.id for m in msgs if m.is_series_head]
+        return result
+
+    def get_thread_replies(self):
+        """Return a dictionary that maps the Message-Id of each message in
+        the thread of series head @self to the list of replies to it"""
+        replies = {}
+        for m in self.get_thread_messages():
+            replies.setdefault(m.in_reply_to, []).append(m)
+        return replies
 
     def get_patches(self):
         if not self.is_series_head:
@@ -812,17 +1386,44 @@ class Message(models.Model):
             .order_by("patch_num")
         )
 
-    def refresh_num_patches(self):
+    def refresh_num_patches(self, save=True):
         c, n = self.get_num()
+        self.patches_received = b""
+        self.num_patches = 0
         if c == n and self.is_patch:
-            self.num_patches = 1
+            self.add_received_patch(c)
         else:
-            self.num_patches = (
-                Message.objects.patches()
-                .filter(project=self.project, in_reply_to=self.message_id)
-                .count()
+            patches = Message.objects.patches().filter(
+                project=self.project, in_reply_to=self.message_id
             )
-        self.save()
+            for num in patches.values_list("patch_num", flat=True):
+                self.add_received_patch(num)
+        if save:
+            self.save()
+
+    def add_received_patch(self, num):
+        """Record in the series head that patch @num was received.  This
+        can be repeated safely, since duplicates are only counted once"""
+        bitmap = bytearray(self.patches_received or b"")
+        if num is not None:
+            byte, bit = divmod(num, 8)
+            if len(bitmap) <= byte:
+                bitmap.extend(bytes(byte + 1 - len(bitmap)))
+            bitmap[byte] |= 1 << bit
+        self.patches_received = bytes(bitmap)
+        self.num_patches = sum(bin(x).count("1") for x in bitmap)
+
+    def has_all_patches(self):
+        # TODO: Handle no cover letter case
+        c, n = self.get_num()
+        if c == n and self.is_patch:
+            return True
+        bitmap = self.patches_received or b""
+        for num in range(1, n + 1):
+            byte, bit = divmod(num, 8)
+            if byte >= len(bitmap) or not bitmap[byte] & (1 << bit):
+                return False
+        return True
 
     def get_total_patches(self):
         num = self.get_num() or (1, 1)
@@ -893,41 +1494,57 @@ class Message(models.Model):
     def get_last_reply_date(self):
         return self.last_reply_date or self.date
 
+    # Larger values are not stored in the "messages" cache; keep in sync
+    # with the memory budget in settings.CACHES
+    MAX_CACHED_SIZE = 16 * 1024
+
+    def get_cached_data(self, name, compute):
+        """Return the data called @name that is derived from the message
+        contents, calling @compute() if it is not cached yet.  The data is
+        shared across requests through the "messages" cache; since the key
+        includes a hash of the contents, it never goes stale."""
+        if not hasattr(self, "_cached_data"):
+            self._cached_data = {}
+        if name in self._cached_data:
+            return self._cached_data[name]
+        if self.id is None:
+            value = compute()
+        else:
+            key = "message:%d:%s:%s" % (self.id, self.mbox_blob_id, name)
+            cache = caches["messages"]
+            value = cache.get(key)
+            if value is None:
+                value = compute()
+                if value is not None and len(value) <= self.MAX_CACHED_SIZE:
+                    cache.set(key, value)
+        self._cached_data[name] = value
+        return value
+
     def get_body(self):
-        return self.get_mbox_obj().get_body()
+        return self.get_cached_data("body", lambda: self.get_mbox_obj().get_body())
+
+    def fill_derived_data(self, m=None):
+        """Compute the columns that are derived from the body of the
+        message.  @m is the already parsed MboxMessage, if any."""
+        m = m or self.get_mbox_obj()
+        self.preview = m.get_preview()
+        self.diff_stat = m.get_diff_stat() if self.is_series_head else ""
 
     def get_preview(self, maxchar=1000):
-        return self.get_mbox_obj().get_preview()
+        if self.preview is not None:
+            return self.preview
+        return self.get_cached_data(
+            "preview", lambda: self.get_mbox_obj().get_preview()
+        )
 
     def get_diff_stat(self):
         if not self.is_series_head:
             return None
-        cur = []
-        patterns = [
-            r"\S*\s*\|\s*[0-9]*( \+*-*)?$",
-            r"\S*\s*\|\s*Bin",
-            r"\S* => \S*\s*|\s*[0-9]* \+*-*$",
-            r"[0-9]* files changed",
-            r"1 file changed",
-            r"(create|delete) mode [0-7]+",
-            r"mode change [0-7]+",
-            r"rename .*\([0-9]+%\)$",
-            r"copy .*\([0-9]+%\)$",
-            r"rewrite .*\([0-9]+%\)$",
-        ]
-        ret = []
-        for l in self.get_body().splitlines():
-            line = l.strip()
-            for p in patterns:
-                if re.match(p, line):
-                    cur.append(line)
-                    ret = cur
-                    break
-            else:
-                cur = []
-                if ret and re.match(r"--- \S", line):
-                    break
-        return "\n".join(ret)
+        if self.diff_stat is not None:
+            return self.diff_stat
+        return self.get_cached_data(
+            "diff-stat", lambda: self.get_mbox_obj().get_diff_stat()
+        )
 
     def get_message_view_url(self):
         assert self.is_patch or self.is_series_head
@@ -946,6 +1563,13 @@ class Message(models.Model):
                 },
             )
 
+    def get_summary(self):
+        assert self.is_series_head
+        try:
+            return self.summary
+        except SeriesSummary.DoesNotExist:
+            return SeriesSummary(message=self)
+
     def get_alternative_revisions(self):
         assert self.is_series_head
         return Message.objects.filter(project=self.project, topic=self.topic)
@@ -978,6 +1602,14 @@ class Message(models.Model):
             ("topic", "last_reply_date"),
             ("topic", "date"),
         ]
+        indexes = [
+            # Replies waiting for their parent, see _adopt_replies
+            models.Index(
+                fields=["project", "in_reply_to"],
+                condition=Q(series_head__isnull=True),
+                name="api_message_orphans",
+            ),
+        ]
 
 
 class MessageResult(Result):
@@ -1007,12 +1639,92 @@ class MessageResult(Result):
         return log_url
 
 
+class SeriesSummaryManager(models.Manager):
+    def update_series(self, series, **fields):
+        """Set @fields in the summary of each message in @series, creating
+        the summaries that do not exist yet, and bump their version"""
+        ids = [s.id for s in series]
+        if not ids:
+            return
+        existing = set(
+            self.filter(message_id__in=ids).values_list("message_id", flat=True)
+        )
+        if existing:
+            self.filter(message_id__in=existing).update(
+                version=F("version") + 1, **fields
+            )
+        self.bulk_create(
+            [
+                SeriesSummary(message_id=i, version=1, **fields)
+                for i in ids
+                if i not in existing
+            ],
+            ignore_conflicts=True,
+        )
+
+    def bump_version(self, series):
+        """Note that something shown in the pages of @series has changed"""
+        self.update_series(series)
+
+
+def summary_testing_status(statuses):
+    """Return the testing status shown in the summary of a series, given
+    the statuses of its testing results"""
+    if not statuses:
+        return None
+    for status in (Result.FAILURE, Result.RUNNING, Result.PENDING):
+        if status in statuses:
+            return status
+    return Result.SUCCESS
+
+
+class SeriesSummary(models.Model):
+    """Status of a series that is shown in series lists, copied from its
+    results and from its newer revisions so that lists can be rendered
+    from a single query.  Each field is kept up to date by the module
+    that owns it; series without a summary have the default values."""
+
+    message = models.OneToOneField(
+        Message, primary_key=True, related_name="summary", on_delete=models.CASCADE
+    )
+    git_status = models.CharField(max_length=7, null=True, blank=True)
+    git_data = jsonfield.JSONField(default={})
+    # pending, running, failure (if any test failed) or success
+    testing_status = models.CharField(max_length=7, null=True, blank=True)
+    obsoleted_by = HeaderFieldModel(blank=True)
+    obsoleted_by_subject = HeaderFieldModel(blank=True)
+    # Bumped whenever the series or its thread change, so that rendered
+    # fragments can be cached under the series id and the version
+    version = models.PositiveIntegerField(default=0)
+
+    objects = SeriesSummaryManager()
+
+
+def _bump_series_version(event, series, **params):
+    SeriesSummary.objects.bump_version([series])
+
+
+def _bump_result_series_version(event, obj, **params):
+    if isinstance(obj, Message) and obj.is_series_head:
+        SeriesSummary.objects.bump_version([obj])
+
+
+register_handler("ResultUpdate", _bump_result_series_version)
+register_handler("TagsUpdate", _bump_series_version)
+register_handler("MaintainersUpdate", _bump_series_version)
+register_handler("SeriesMerged", _bump_series_version)
+
+
 class Module(models.Model):
     """Module information"""
 
     name = models.CharField(max_length=128, unique=True)
     config = models.TextField(blank=True)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        mod.invalidate_render_page_context()
+
     def __str__(self):
         return self.name
 
@@ -1027,3 +1739,78 @@ class WatchedQuery(models.Model):
 
     def __str__(self):
         return self.query + " for user " + self.user.username
+
+
+class Change(models.Model):
+    """An entry in the change feed.  The id is the sequence number that
+    clients pass back to fetch the changes that followed; changes are
+    only created after the transaction that caused them commits, see
+    _insert_change."""
+
+    event = models.CharField(max_length=32)
+    timestamp = models.DateTimeField(default=datetime.datetime.utcnow)
+    # Changes outlive the objects that they refer to, so that deletions
+    # can be recorded too: the project is a plain id and the message is
+    # also identified by its Message-Id
+    project = models.ForeignKey(
+        Project, related_name="+", on_delete=models.DO_NOTHING, db_constraint=False
+    )
+    message = models.ForeignKey(
+        Message, null=True, related_name="+", on_delete=models.SET_NULL
+    )
+    msgid = HeaderFieldModel(blank=True)
+    # The result or property that changed, if any
+    name = models.CharField(max_length=256, blank=True)
+
+    class Meta:
+        index_together = [("project", "id")]
+
+
+def _insert_change(change):
+    # Clients follow the feed by id, so a change must not become visible
+    # after one with a higher id.  Insert it only once the transaction that
+    # caused it has committed, and one at a time (SQLite already serializes
+    # all writes).
+    def insert():
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE"
+                        % Change._meta.db_table
+                    )
+            change.save()
+
+    transaction.on_commit(insert)
+
+
+def _record_change(event, obj=None, message=None, series=None, result=None, **params):
+    message = message or series or (obj if isinstance(obj, Message) else None)
+    _insert_change(
+        Change(
+            event=event,
+            project_id=message.project_id if message else obj.id,
+            message_id=message.id if message else None,
+            msgid=message.message_id if message else "",
+            name=result.name if result else params.get("name", ""),
+        )
+    )
+
+
+def _record_deletion(event, message=None, project=None, **params):
+    if message is not None:
+        _insert_change(
+            Change(event=event, project_id=message.project_id, msgid=message.message_id)
+        )
+    else:
+        _insert_change(Change(event=event, project_id=project.id))
+
+
+register_handler("MessageAdded", _record_change)
+register_handler("ResultUpdate", _record_change)
+register_handler("SetProperty", _record_change)
+register_handler("TagsUpdate", _record_change)
+register_handler("MaintainersUpdate", _record_change)
+register_handler("SeriesMerged", _record_change)
+register_handler("MessageDeleted", _record_deletion)
+register_handler("ProjectDeleted", _record_deletion)
@@ -10,14 +10,24 @@
 
 from collections import OrderedDict
 from django.contrib.auth.models import User
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
 from django.template import loader
 from django.db.models import F
 import django.db.utils
 
 from mod import dispatch_module_hook
-from ..models import Project, ProjectResult, Message, MessageResult, Result
+from patchew.conditional import conditional_response
+from ..models import (
+    Change,
+    Maintainer,
+    Project,
+    ProjectResult,
+    Message,
+    MessageResult,
+    Result,
+)
 from ..search import SearchEngine
+from .pagination import ChangesPagination
 from rest_framework import (
     permissions,
     serializers,
@@ -29,9 +39,11 @@ from rest_framework import (
     status,
 )
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.fields import (
     SerializerMethodField,
     CharField,
+    IntegerField,
     JSONField,
     EmailField,
     ListField,
@@ -40,7 +52,7 @@ from rest_framework.relations import HyperlinkedIdentityField
 from rest_framework.response import Response
 from rest_framework.views import APIView
 import rest_framework
-from mbox import addr_db_to_rest, MboxMessage
+from mbox import addr_db_to_rest, decode_message, split_mbox, MboxMessage
 from rest_framework.parsers import BaseParser
 
 SEARCH_PARAM = "q"
@@ -60,6 +72,10 @@ class StaticTextRenderer(renderers.BaseRenderer):
             return data
 
 
+class PlainTextRenderer(StaticTextRenderer):
+    format = "txt"
+
+
 # patchew-specific permission classes
 
 
@@ -138,6 +154,11 @@ class MaintainerPermission(PatchewPermission):
         return False
 
 
+class SuperuserPermission(PatchewPermission):
+    def has_permission(self, request, view):
+        return self.is_superuser(request)
+
+
 class ImportPermission(PatchewPermission):
     allowed_groups = ("importers",)
 
@@ -456,6 +477,7 @@ class SeriesSerializer(BaseMessageSerializer):
             "total_patches",
             "results",
             "mbox_uri",
+            "diff_stat",
         )
         fields = (
             BaseMessageSerializer.Meta.fields
@@ -482,6 +504,7 @@ class SeriesSerializer(BaseMessageSerializer):
         view_name="results-list", lookup_field="series_message_id"
     )
     total_patches = SerializerMethodField()
+    diff_stat = SerializerMethodField()
     maintainers = ListField(child=CharField(), required=False)
 
     def __init__(self, *args, **kwargs):
@@ -502,6 +525,15 @@ class SeriesSerializer(BaseMessageSerializer):
     def get_total_patches(self, obj):
         return obj.get_total_patches()
 
+    def get_diff_stat(self, obj):
+        return obj.get_diff_stat()
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        if "maintainers" in validated_data:
+            Maintainer.objects.update_series(instance)
+        return instance
+
 
 class SeriesSerializerFull(SeriesSerializer):
     class Meta:
@@ -526,7 +558,7 @@ class PatchewSearchFilter(filters.BaseFilterBackend):
     def filter_queryset(self, request, queryset, view):
         search = request.query_params.get(self.search_param) or ""
         se = SearchEngine(terms=[search], user=request.user)
-        query = se.search_series(queryset=queryset)
+        query = se.search_series(queryset=queryset, cached=True)
         return query
 
     def to_html(self, request, queryset, view):
@@ -545,10 +577,16 @@ class PatchewOrderingFilter(filters.OrderingFilter):
         for i in self.get_ordering(request, queryset, view):
             if i[0] == "-":
                 i = i[1:]
+            # End with the id, so that pages (especially the cursors of
+            # PatchewPagination) do not depend on how ties are broken
             if i == "last_reply_date":
-                queryset = queryset.order_by(F("last_reply_date").desc(nulls_last=True), "-date")
+                queryset = queryset.order_by(
+                    F("last_reply_date").desc(nulls_last=True), "-date", "-id"
+                )
+            elif i == "id":
+                queryset = queryset.order_by("-id")
             else:
-                queryset = queryset.order_by("-" + i)
+                queryset = queryset.order_by("-" + i, "-id")
 
         return queryset
 
@@ -565,12 +603,27 @@ class PatchewOrderingFilter(filters.OrderingFilter):
 
 class SeriesViewSet(BaseMessageViewSet):
     serializer_class = SeriesSerializer
-    queryset = Message.objects.filter(topic__isnull=False)
+    queryset = Message.objects.series_list(
+        Message.objects.filter(topic__isnull=False),
+        keep=("recipients", "tags", "diff_stat"),
+    )
     filter_backends = (PatchewSearchFilter, PatchewOrderingFilter)
     search_fields = (SEARCH_PARAM,)
     ordering_fields = ['date', 'id', 'last_reply_date']
     ordering = ['id']
 
+    # The plan covers all projects, and the database's plan can reveal
+    # how much data there is, even when reached through a project
+    @action(
+        detail=False,
+        renderer_classes=[PlainTextRenderer],
+        permission_classes=[SuperuserPermission],
+    )
+    def explain(self, request, *args, **kwargs):
+        search = request.query_params.get(SEARCH_PARAM) or ""
+        se = SearchEngine(terms=[search], user=request.user)
+        return Response(se.explain())
+
 
 class ProjectSeriesViewSet(
     ProjectMessagesViewSetMixin,
@@ -589,16 +642,15 @@ class ProjectSeriesViewSet(
             ).order_by("patch_num")
         return patches
 
-    def collect_replies(self, parent, result):
-        replies = Message.objects.filter(
-            in_reply_to=parent.message_id,
-            project=self.kwargs["projects_pk"],
-            is_patch=False,
-        ).order_by("date")
+    def collect_replies(self, parent, result, thread):
+        replies = sorted(
+            [x for x in thread.get(parent.message_id, []) if not x.is_patch],
+            key=lambda x: x.date,
+        )
         for m in replies:
             result.append(m)
         for m in replies:
-            self.collect_replies(m, result)
+            self.collect_replies(m, result, thread)
         return result
 
     def get_serializer_class(self, *args, **kwargs):
@@ -609,10 +661,11 @@ class ProjectSeriesViewSet(
     def get_object(self):
         series = super().get_object()
         series.patches = self.collect_patches(series)
-        series.replies = self.collect_replies(series, [])
+        thread = series.get_thread_replies()
+        series.replies = self.collect_replies(series, [], thread)
         if not series.is_patch:
             for i in series.patches:
-                self.collect_replies(i, series.replies)
+                self.collect_replies(i, series.replies, thread)
         return series
 
     def perform_destroy(self, instance):
@@ -620,11 +673,21 @@ class ProjectSeriesViewSet(
 
     @action(detail=True, renderer_classes=[StaticTextRenderer])
     def mbox(self, request, *args, **kwargs):
-        message = self.get_object()
-        mbox = message.get_mbox_with_tags()
-        if not mbox:
-            raise Http404("Series not complete")
-        return Response(mbox)
+        # the patches and replies that get_object collects are not needed
+        series = super().get_object()
+
+        def make_response():
+            mbox = series.get_mbox_with_tags()
+            if not mbox:
+                raise Http404("Series not complete")
+            return Response(mbox)
+
+        return conditional_response(
+            request,
+            make_response,
+            etag=series.get_mbox_etag(),
+            last_modified=series.last_reply_date or series.date,
+        )
 
 
 # Messages
@@ -667,6 +730,15 @@ class MessagePlainTextParser(BaseParser):
         return MboxMessage(data).get_json()
 
 
+class MboxParser(BaseParser):
+    media_type = "application/mbox"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        # Split before decoding, so that each message can have its own
+        # encoding
+        return {"mboxes": [decode_message(x) for x in split_mbox(stream.read())]}
+
+
 class ProjectMessagesViewSet(
     ProjectMessagesViewSetMixin,
     BaseMessageViewSet,
@@ -674,18 +746,42 @@ class ProjectMessagesViewSet(
     mixins.DestroyModelMixin,
     mixins.UpdateModelMixin,
 ):
+    # MessageSerializer includes the mbox
+    queryset = Message.objects.select_related("mbox_blob")
     parser_classes = APIView.parser_classes + [MessagePlainTextParser]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "mbox":
+            # the blob is only loaded if the client does not have it yet
+            queryset = queryset.select_related(None)
+        return queryset
+
     def get_serializer_class(self, *args, **kwargs):
         if self.request.method == "POST":
             return MessageCreationSerializer
         else:
             return MessageSerializer
 
+    def perform_destroy(self, instance):
+        Message.objects.delete_messages([instance])
+
     @action(detail=True, renderer_classes=[StaticTextRenderer])
     def mbox(self, request, *args, **kwargs):
         message = self.get_object()
-        return Response(message.get_mbox())
+
+        def make_response():
+            return StreamingHttpResponse(
+                message.mbox_blob.iter_data(), content_type="text/plain; charset=utf-8"
+            )
+
+        # blobs are addressed by the hash of their contents
+        return conditional_response(
+            request,
+            make_response,
+            etag=message.mbox_blob_id,
+            last_modified=message.date,
+        )
 
     @action(detail=True)
     def replies(self, request, *args, **kwargs):
@@ -701,6 +797,8 @@ class ProjectMessagesViewSet(
 
 
 class MessagesViewSet(BaseMessageViewSet):
+    # MessageSerializer includes the mbox
+    queryset = Message.objects.select_related("mbox_blob")
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     parser_classes = APIView.parser_classes + [MessagePlainTextParser]
 
@@ -712,7 +810,7 @@ class MessagesViewSet(BaseMessageViewSet):
 
     def create(self, request, *args, **kwargs):
         m = MboxMessage(request.data["mbox"])
-        projects = [p for p in Project.objects.all() if p.recognizes(m)]
+        projects = Project.find_projects_for_message(m)
         grps = request.user.groups.all()
         grps_name = [grp.name for grp in grps]
         if "importers" not in grps_name:
@@ -732,6 +830,43 @@ class MessagesViewSet(BaseMessageViewSet):
             status=status.HTTP_201_CREATED if results else status.HTTP_200_OK,
         )
 
+    @action(
+        methods=["post"],
+        detail=False,
+        url_path="import",
+        parser_classes=APIView.parser_classes + [MboxParser],
+    )
+    def import_mboxes(self, request, *args, **kwargs):
+        """
+        Import many messages at once.  The body is either an mbox file
+        (content type application/mbox) or a JSON object like
+        {"mboxes": ["...", "..."]}.
+        """
+        mboxes = request.data.get("mboxes")
+        if not isinstance(mboxes, list):
+            return Response("mboxes must be a list", status=status.HTTP_400_BAD_REQUEST)
+
+        def filter_projects(projects):
+            return [p for p in projects if p.maintained_by(request.user)]
+
+        grps_name = [grp.name for grp in request.user.groups.all()]
+        if "importers" in grps_name:
+            filter_projects = None
+        added = Message.objects.add_messages_from_mboxes(mboxes, filter_projects)
+        projects = sorted(set(m.project for m in added), key=lambda p: p.id)
+        return Response(
+            OrderedDict(
+                [
+                    ("count", len(added)),
+                    (
+                        "projects",
+                        [reverse_detail(p, request) for p in projects],
+                    ),
+                ]
+            ),
+            status=status.HTTP_201_CREATED if added else status.HTTP_200_OK,
+        )
+
 
 # Results
 class HyperlinkedResultField(HyperlinkedIdentityField):
@@ -854,3 +989,70 @@ class SeriesResultsViewSet(ResultsViewSet):
             message__project=self.kwargs["projects_pk"],
             message__message_id=self.kwargs["series_message_id"],
         )
+
+
+# Change feed
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Change
+        fields = (
+            "seq",
+            "event",
+            "timestamp",
+            "project",
+            "message_id",
+            "message",
+            "name",
+        )
+
+    seq = IntegerField(source="id")
+    project = SerializerMethodField()
+    message_id = SerializerMethodField()
+    message = SerializerMethodField()
+
+    def get_message_id(self, obj):
+        return obj.msgid or None
+
+    def get_project(self, obj):
+        request = self.context["request"]
+        return rest_framework.reverse.reverse(
+            "project-detail", request=request, kwargs={"pk": obj.project_id}
+        )
+
+    def get_message(self, obj):
+        # The message could have been deleted since
+        if obj.message_id is None:
+            return None
+        request = self.context["request"]
+        return rest_framework.reverse.reverse(
+            "messages-detail",
+            request=request,
+            kwargs={"projects_pk": obj.project_id, "message_id": obj.msgid},
+        )
+
+
+class ChangesViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Changes to messages, series, results and properties, oldest first.
+    Pass the "seq" of the last change that was seen as "since" to get the
+    changes that followed it, optionally only for one "project" (an id).
+    Changes are numbered in the order in which they become visible, so
+    following "since" never misses a change.
+    """
+
+    serializer_class = ChangeSerializer
+    pagination_class = ChangesPagination
+    permission_classes = (PatchewPermission,)
+
+    def get_queryset(self):
+        queryset = Change.objects.order_by("id")
+        try:
+            since = int(self.request.query_params.get("since", 0))
+            project = self.request.query_params.get("project")
+            if project is not None:
+                queryset = queryset.filter(project_id=int(project))
+        except ValueError:
+            raise ValidationError("since and project must be integers")
+        return queryset.filter(id__gt=since)
@@ -8,8 +8,15 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 # remove count from paginator
@@ -18,7 +25,34 @@ from rest_framework.response import Response
 # results in a circular dependency between modules.
 
 
+def keyset_filter(keys, values):
+    """Return a filter for the rows that come after @values in an ordering
+    by @keys, a list of (field, descending, nulls_last) tuples.  Unlike an
+    offset, the filter lets the database start from the position in the
+    index instead of scanning and discarding the earlier rows."""
+    (name, descending, nulls_last), value = keys[0], values[0]
+    if value is None:
+        after = Q(**{name + "__isnull": False}) if not nulls_last else Q(pk__in=[])
+        same = Q(**{name + "__isnull": True})
+    else:
+        after = Q(**{name + ("__lt" if descending else "__gt"): value})
+        if nulls_last:
+            after |= Q(**{name + "__isnull": True})
+        same = Q(**{name: value})
+    if len(keys) == 1:
+        return after
+    return after | (same & keyset_filter(keys[1:], values[1:]))
+
+
 class PatchewPagination(LimitOffsetPagination):
+    cursor_query_param = "cursor"
+    cursor_query_description = (
+        "Position returned in the previous page's next link.  Pass an empty "
+        "cursor to start from the first result; unlike offset, walking all "
+        "the pages with cursors takes linear time."
+    )
+    invalid_cursor_message = "Invalid cursor"
+
     def get_paginated_response(self, data):
         return Response(
             {
@@ -29,6 +63,8 @@ class PatchewPagination(LimitOffsetPagination):
         )
 
     def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            return self.paginate_queryset_by_cursor(queryset, request)
         self.offset = self.get_offset(request)
         self.limit = self.get_limit(request)
 
@@ -48,3 +84,145 @@ class PatchewPagination(LimitOffsetPagination):
         ret = super().get_paginated_response_schema(schema)
         del ret["properties"]["count"]
         return ret
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": self.cursor_query_description,
+                "schema": {"type": "string"},
+            }
+        ]
+
+    def get_keyset(self, queryset):
+        """Return the keys of the ordering of @queryset, as expected by
+        keyset_filter, adding the primary key to make the ordering total"""
+        keys = []
+        for o in queryset.query.order_by:
+            if isinstance(o, str):
+                descending = o.startswith("-")
+                name = o.lstrip("-")
+                nulls_last = None
+            else:
+                descending = o.descending
+                name = o.expression.name
+                nulls_last = o.nulls_last or (False if o.nulls_first else None)
+            if name == "pk":
+                name = "id"
+            try:
+                field = queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ValidationError("Cannot use a cursor with this ordering")
+            if field.null:
+                # Where NULLs go depends on the database, unless it is explicit
+                if nulls_last is None:
+                    raise ValidationError("Cannot use a cursor with this ordering")
+            else:
+                nulls_last = False
+            keys.append((field.attname, descending, nulls_last))
+            if field.primary_key:
+                break
+        else:
+            keys.append(("id", True, False))
+        return keys
+
+    def encode_cursor(self, keys, obj):
+        values = [getattr(obj, name) for name, descending, nulls_last in keys]
+        # DjangoJSONEncoder would truncate the microseconds
+        data = json.dumps(values, default=str).encode("utf-8")
+        return base64.urlsafe_b64encode(data).decode("ascii")
+
+    def decode_cursor(self, queryset, keys, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if not isinstance(values, list) or len(values) != len(keys):
+                raise ValueError
+            return [
+                None if v is None else queryset.model._meta.get_field(name).to_python(v)
+                for (name, descending, nulls_last), v in zip(keys, values)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset_by_cursor(self, queryset, request):
+        self.request = request
+        self.limit = self.get_limit(request)
+        keys = self.get_keyset(queryset)
+        if len(keys) > len(queryset.query.order_by):
+            queryset = queryset.order_by(*queryset.query.order_by, "-id")
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            values = self.decode_cursor(queryset, keys, cursor)
+            queryset = queryset.filter(keyset_filter(keys, values))
+
+        # Get one extra element to check if there is a "next" page
+        q = list(queryset[: self.limit + 1])
+        self.cursor = None
+        if len(q) > self.limit:
+            q.pop()
+            self.cursor = self.encode_cursor(keys, q[-1])
+        return q
+
+    def get_next_link(self):
+        if self.cursor_query_param not in self.request.query_params:
+            return super().get_next_link()
+        if self.cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.cursor)
+
+    def get_previous_link(self):
+        # Cursors only go forward
+        if self.cursor_query_param in self.request.query_params:
+            return None
+        return super().get_previous_link()
+
+
+class ChangesPagination(PatchewPagination):
+    """Pages of the change feed.  The next page starts after the last
+    change of the current one, so the feed is walked with a range scan
+    on the sequence numbers instead of an offset."""
+
+    since_query_param = "since"
+    since_query_description = "Sequence number of the last change seen."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        # Get one extra element to check if there is a "next" page
+        q = list(queryset[: self.limit + 1])
+        self.since = None
+        if len(q) > self.limit:
+            q.pop()
+            self.since = q[-1].id
+        return q
+
+    def get_next_link(self):
+        if self.since is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.since_query_param, self.since)
+
+    def get_previous_link(self):
+        return None
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.limit_query_param,
+                "required": False,
+                "in": "query",
+                "description": str(self.limit_query_description),
+                "schema": {"type": "integer"},
+            },
+            {
+                "name": self.since_query_param,
+                "required": False,
+                "in": "query",
+                "description": self.since_query_description,
+                "schema": {"type": "integer"},
+            },
+        ]
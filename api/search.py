@@ -8,20 +8,43 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
-from .models import Message, MessageResult, Project, Result, QueuedSeries
+from . import fts
+from .models import Maintainer, Message, MessageResult, Project, Result, QueuedSeries
 from collections import namedtuple
-from functools import reduce
+from functools import lru_cache, reduce
+import datetime
+import hashlib
 import operator
+import re
+import uuid
 
-from django.db import connection
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.functional import cached_property
 
-from django.contrib.postgres.search import SearchQuery, SearchVector, SearchVectorField
 from django.db.models import Lookup
 from django.db.models.fields import Field
 
 import abc
 import compynator.core
+from event import register_handler
+
+# Number of parsed queries that are kept around
+PARSE_CACHE_SIZE = 1024
+# Anonymous searches are answered from a cached list of series ids, as
+# long as there are few matches
+SEARCH_CACHE_TIMEOUT = 60
+SEARCH_CACHE_MAX_SERIES = 1000
+
+# Estimated cost of the terms, used by the planner to evaluate cheap and
+# selective conditions first: indexed columns of the series, other columns,
+# subqueries on indexed tables and finally text matches
+COST_INDEXED = 1
+COST_COLUMN = 2
+COST_SUBQUERY = 4
+COST_TEXT = 8
 
 
 @Field.register_lookup
@@ -39,50 +62,62 @@ class InvalidSearchTerm(Exception):
     pass
 
 
-# Hack alert: Django wraps each argument to to_tsvector with a COALESCE function,
-# and that causes postgres not to use the index.  Monkeypatch as_sql to skip
-# that step, which we do not need since the subject field is not nullable.
-class NonNullSearchVector(SearchVector):
-    function = "to_tsvector"
-    arg_joiner = " || ' ' || "
-    _output_field = SearchVectorField()
-
-    def as_sql(self, compiler, connection, function=None, template=None):
-        config_sql = None
-        config_params = []
-        if template is None:
-            if self.config:
-                config_sql, config_params = compiler.compile(self.config)
-                template = "%(function)s(%(config)s, %(expressions)s)"
-            else:
-                template = self.template
-        sql, params = super(SearchVector, self).as_sql(
-            compiler,
-            connection,
-            function=function,
-            template=template,
-            config=config_sql,
-        )
-        extra_params = []
-        if self.weight:
-            weight_sql, extra_params = compiler.compile(self.weight)
-            sql = "setweight({}, {})".format(sql, weight_sql)
-        return sql, config_params + params + extra_params
-
-
 # The abstract syntax tree of the search.  This allows:
 # - showing the project name if the result of the search is a single project
 # - highlighting all keywords
-# - using a single SearchVector for multiple ANDed keywords
 #
 # On top of this, SearchMaint and SearchQueue allow to use a singleton parser
 # that does not know about requests, and only resolve the user ("me") later
+#
+# Finally, test_series() matches a single series in memory, falling back to
+# the database only for the terms that need it (such as keywords);
+# this is used to update the watched queues of all users at once
+#
+# Between parsing and building the query, plan() rewrites the tree: the
+# operands of AND and OR are sorted by get_cost(), constant operands are
+# folded, and the project terms of a conjunction are also applied inside
+# the subqueries on results, which have a denormalized project column
 
 
 class SearchExpression(metaclass=abc.ABCMeta):
     def get_project(self):
         return None
 
+    def get_project_names(self):
+        """Return the names of the projects (or parent projects) that
+        matching series can belong to, or None if the expression does not
+        restrict the project."""
+        return None
+
+    def uses_queues(self):
+        return False
+
+    def test_series(self, snapshot, user):
+        return snapshot.test_query(self, user)
+
+    def get_cost(self):
+        return COST_COLUMN
+
+    def plan(self, projects):
+        """Return an equivalent expression that is cheaper to evaluate.
+        @projects are the names of the projects that the enclosing
+        conjunctions restrict the search to."""
+        return self
+
+    def get_children(self):
+        return []
+
+    def describe(self):
+        return type(self).__name__
+
+    def explain(self, indent=0):
+        """Return a list of lines describing the expression and the
+        estimated cost of each node"""
+        lines = ["%s%s  (cost=%d)" % ("  " * indent, self.describe(), self.get_cost())]
+        for child in self.get_children():
+            lines += child.explain(indent + 1)
+        return lines
+
     def get_all_keywords(self):
         return self.get_keywords()
 
@@ -121,8 +156,17 @@ class SearchFalse(SearchExpression):
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         return Q(pk=None)
 
+    def test_series(self, snapshot, user):
+        return False
+
+    def get_cost(self):
+        return 0
+
+    def describe(self):
+        return "FALSE"
+
     def __invert__(self):
-        return SearchTrue(self)
+        return SearchTrue()
 
     def __or__(self, rhs):
         return rhs
@@ -132,8 +176,17 @@ class SearchTrue(SearchExpression):
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         return Q()
 
+    def test_series(self, snapshot, user):
+        return True
+
+    def get_cost(self):
+        return 0
+
+    def describe(self):
+        return "TRUE"
+
     def __invert__(self):
-        return SearchFalse(self)
+        return SearchFalse()
 
     def __and__(self, rhs):
         return rhs
@@ -146,6 +199,24 @@ class SearchNot(SearchExpression, namedtuple("SearchNot", ["op"])):
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         return ~self.op.get_query(user, keyword_map, keyword_final)
 
+    def uses_queues(self):
+        return self.op.uses_queues()
+
+    def test_series(self, snapshot, user):
+        return not self.op.test_series(snapshot, user)
+
+    def get_cost(self):
+        return self.op.get_cost()
+
+    def plan(self, projects):
+        return ~self.op.plan(projects)
+
+    def get_children(self):
+        return [self.op]
+
+    def describe(self):
+        return "NOT"
+
     def __invert__(self):
         return self.op
 
@@ -154,11 +225,37 @@ class SearchBinary(SearchExpression, namedtuple("SearchBinary", ["left", "right"
     def get_all_keywords(self):
         return self.left.get_all_keywords() + self.right.get_all_keywords()
 
+    def uses_queues(self):
+        return self.left.uses_queues() or self.right.uses_queues()
+
+    def get_cost(self):
+        return self.left.get_cost() + self.right.get_cost()
+
+    def get_operands(self):
+        # Nested operations of the same kind, flattened
+        return [
+            operand
+            for side in (self.left, self.right)
+            for operand in (side.get_operands() if type(side) is type(self) else [side])
+        ]
+
+    def get_children(self):
+        return self.get_operands()
+
 
 class SearchAnd(SearchBinary):
     def get_project(self):
         return self.left.get_project() or self.right.get_project()
 
+    def get_project_names(self):
+        left = self.left.get_project_names()
+        right = self.right.get_project_names()
+        if left is None:
+            return right
+        if right is None:
+            return left
+        return left & right
+
     def get_keywords(self):
         return self.left.get_keywords() + self.right.get_keywords()
 
@@ -167,6 +264,27 @@ class SearchAnd(SearchBinary):
             user, keyword_map, keyword_final
         ) & self.right.get_query_no_keywords(user, keyword_map, keyword_final)
 
+    def test_series(self, snapshot, user):
+        return self.left.test_series(snapshot, user) and self.right.test_series(
+            snapshot, user
+        )
+
+    def plan(self, projects):
+        operands = self.get_operands()
+        projects = projects + tuple(
+            x.name
+            for x in operands
+            if isinstance(x, SearchProject) and x.name not in projects
+        )
+        operands = [x.plan(projects) for x in operands]
+        if any(isinstance(x, SearchFalse) for x in operands):
+            return SearchFalse()
+        operands.sort(key=lambda x: x.get_cost())
+        return reduce(operator.and_, operands, SearchTrue())
+
+    def describe(self):
+        return "AND"
+
 
 class SearchOr(SearchBinary):
     def get_project(self):
@@ -175,6 +293,13 @@ class SearchOr(SearchBinary):
             return candidate if self.right.get_project() == candidate else None
         return None
 
+    def get_project_names(self):
+        left = self.left.get_project_names()
+        right = self.right.get_project_names()
+        if left is None or right is None:
+            return None
+        return left | right
+
     def get_keywords(self):
         return []
 
@@ -185,6 +310,21 @@ class SearchOr(SearchBinary):
             user, keyword_map, keyword_final
         ) | self.right.get_query(user, keyword_map, keyword_final)
 
+    def test_series(self, snapshot, user):
+        return self.left.test_series(snapshot, user) or self.right.test_series(
+            snapshot, user
+        )
+
+    def plan(self, projects):
+        operands = [x.plan(projects) for x in self.get_operands()]
+        if any(isinstance(x, SearchTrue) for x in operands):
+            return SearchTrue()
+        operands.sort(key=lambda x: x.get_cost())
+        return reduce(operator.or_, operands, SearchFalse())
+
+    def describe(self):
+        return "OR"
+
 
 class SearchTerm(SearchExpression, namedtuple("SearchTerm", ["project", "query"])):
     def __invert__(self):
@@ -196,6 +336,15 @@ class SearchTerm(SearchExpression, namedtuple("SearchTerm", ["project", "query"]
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         return self.query
 
+    def test_series(self, snapshot, user):
+        try:
+            return _test_q(snapshot.series, self.query)
+        except _NeedsDatabase:
+            return snapshot.test_query(self, user)
+
+    def describe(self):
+        return str(self.query)
+
 
 class SearchKeyword(SearchExpression, namedtuple("SearchKeyword", ["keyword"])):
     def get_keywords(self):
@@ -204,11 +353,50 @@ class SearchKeyword(SearchExpression, namedtuple("SearchKeyword", ["keyword"])):
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         return Q()
 
+    def get_cost(self):
+        return COST_TEXT
 
-class SearchSubquery(SearchExpression, namedtuple("SearchQueue", ["model", "q"])):
+    def describe(self):
+        return "subject matches %r" % self.keyword
+
+
+class SearchSubquery(
+    SearchExpression,
+    namedtuple("SearchSubquery", ["model", "q", "projects"], defaults=[()]),
+):
+    # @projects are pushed down by the planner from the enclosing
+    # conjunctions; they are redundant with the filter on the series, but
+    # let the database look up the results through the (status, name,
+    # project) index
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
-        message_ids = self.model.objects.filter(self.q).values("message_id")
-        return Q(id__in=message_ids)
+        q = self.q
+        for name in self.projects:
+            q &= Q(project__in=_get_project_ids_query(name))
+        # EXISTS is planned as a semi-join, and NOT EXISTS as an anti-join
+        related = self.model.objects.filter(q, message=OuterRef("pk"))
+        return Q(Exists(related))
+
+    def test_series(self, snapshot, user):
+        try:
+            return any(_test_q(obj, self.q) for obj in snapshot.related(self.model))
+        except _NeedsDatabase:
+            return snapshot.test_query(self, user)
+
+    def get_cost(self):
+        return COST_SUBQUERY
+
+    def plan(self, projects):
+        try:
+            self.model._meta.get_field("project")
+        except FieldDoesNotExist:
+            return self
+        return self._replace(projects=projects)
+
+    def describe(self):
+        desc = "EXISTS %s %s" % (self.model.__name__, self.q)
+        if self.projects:
+            desc += " in project %s" % ", ".join(self.projects)
+        return desc
 
 
 class SearchQueue(SearchExpression, namedtuple("SearchQueue", ["queues", "username"])):
@@ -223,16 +411,215 @@ class SearchQueue(SearchExpression, namedtuple("SearchQueue", ["queues", "userna
         message_ids = QueuedSeries.objects.filter(q).values("message_id")
         return Q(id__in=message_ids)
 
+    def uses_queues(self):
+        return True
+
+    def get_cost(self):
+        return COST_SUBQUERY
+
+    def describe(self):
+        return "queue %s of %s" % ("|".join(self.queues), self.username)
+
+    def test_series(self, snapshot, user):
+        if self.username == "me":
+            if not user.is_authenticated:
+                return False
+            return any(
+                user_id == user.id and name in self.queues
+                for user_id, username, name in snapshot.queues
+            )
+        return any(
+            username == self.username and name in self.queues
+            for user_id, username, name in snapshot.queues
+        )
+
+
+class SearchProject(SearchExpression, namedtuple("SearchProject", ["name"])):
+    def get_project(self):
+        return self.name
+
+    def get_project_names(self):
+        return {self.name}
+
+    def get_query_no_keywords(self, user, keyword_map, keyword_final):
+        ids = Project.get_project_ids_by_name(self.name)
+        return Q(project__pk__in=ids)
+
+    def get_cost(self):
+        return COST_INDEXED
+
+    def describe(self):
+        return "project %s" % self.name
+
+    def test_series(self, snapshot, user):
+        project = snapshot.series.project
+        return project.name == self.name or (
+            project.parent_project is not None
+            and project.parent_project.name == self.name
+        )
+
+
+class SearchAge(SearchExpression, namedtuple("SearchAge", ["less", "seconds"])):
+    # The reference date is computed when the query is built, so that
+    # parsed expressions can be kept around
+    def get_cutoff(self):
+        return datetime.datetime.now() - datetime.timedelta(0, self.seconds)
+
+    def get_query_no_keywords(self, user, keyword_map, keyword_final):
+        if self.less:
+            return Q(date__gte=self.get_cutoff())
+        else:
+            return Q(date__lte=self.get_cutoff())
+
+    def test_series(self, snapshot, user):
+        if self.less:
+            return snapshot.series.date >= self.get_cutoff()
+        else:
+            return snapshot.series.date <= self.get_cutoff()
+
+    def get_cost(self):
+        return COST_INDEXED
+
+    def describe(self):
+        return "age %s %ds" % ("<" if self.less else ">", self.seconds)
+
+
+class SearchBody(SearchExpression, namedtuple("SearchBody", ["keyword"])):
+    def get_query_no_keywords(self, user, keyword_map, keyword_final):
+        # Series match if the words are in the cover letter or in a patch
+        message_ids = fts.match("body", self.keyword)
+        patches = Message.objects.filter(id__in=message_ids, is_patch=True)
+        return Q(id__in=message_ids) | Q(id__in=patches.values("series_head_id"))
+
+    def get_cost(self):
+        return COST_TEXT
+
+    def describe(self):
+        return "body matches %r" % self.keyword
+
 
 class SearchMaint(SearchExpression, namedtuple("SearchMaint", ["rhs"])):
+    # Emails are stored in lowercase, so "me" is an exact match on the
+    # (email, message) index
     def get_query_no_keywords(self, user, keyword_map, keyword_final):
         if self.rhs == "me":
-            if not user.is_authenticated:
+            if not user.is_authenticated or not user.email:
                 # Django hack to return an always false Q object
                 return Q(pk=None)
-            return Q(maintainers__icontains=user.email)
+            q = Q(email=user.email.lower())
         else:
-            return Q(maintainers__icontains=self.rhs)
+            q = Q(email__icontains=self.rhs) | Q(name__icontains=self.rhs)
+        return Q(id__in=Maintainer.objects.filter(q).values("message_id"))
+
+    def test_series(self, snapshot, user):
+        maintainers = snapshot.related(Maintainer)
+        if self.rhs == "me":
+            if not user.is_authenticated or not user.email:
+                return False
+            email = user.email.lower()
+            return any(m.email == email for m in maintainers)
+        rhs = self.rhs.lower()
+        return any(rhs in m.email or rhs in m.name.lower() for m in maintainers)
+
+    def get_cost(self):
+        return COST_SUBQUERY if self.rhs == "me" else COST_TEXT
+
+    def describe(self):
+        return "maintained by %s" % self.rhs
+
+
+def _get_project_ids_query(name):
+    # Same as Project.get_project_ids_by_name(), but as a subquery
+    q = Q(name=name) | Q(parent_project__name=name)
+    return Project.objects.filter(q).values("id")
+
+
+def plan(expr):
+    """Return an expression equivalent to @expr, but cheaper to evaluate
+    either with a query or with test_series()"""
+    return expr.plan(())
+
+
+# Evaluate the Q objects built by the parser against a model instance.  Only
+# the lookups that the parser uses on plain columns are supported; anything
+# else raises _NeedsDatabase and the term is matched with a query instead.
+
+
+class _NeedsDatabase(Exception):
+    pass
+
+
+def _compare_lookup(op, lhs, rhs, field):
+    if op in ("contains", "icontains", "startswith"):
+        if lhs is None:
+            return False
+        lhs = str(field.get_prep_value(lhs))
+        if op == "icontains":
+            return rhs.lower() in lhs.lower()
+        if op == "contains":
+            return rhs in lhs
+        return lhs.startswith(rhs)
+    if op == "isnull":
+        return (lhs is None) == rhs
+    if lhs is None:
+        return False
+    lhs = field.get_prep_value(lhs)
+    if op == "in":
+        return lhs in [field.get_prep_value(x) for x in rhs]
+    rhs = field.get_prep_value(rhs)
+    if op == "exact":
+        return lhs == rhs
+    if op == "ne":
+        return lhs != rhs
+    if op == "gte":
+        return lhs >= rhs
+    if op == "lte":
+        return lhs <= rhs
+    raise _NeedsDatabase()
+
+
+_LOOKUPS = (
+    "exact",
+    "ne",
+    "in",
+    "contains",
+    "icontains",
+    "startswith",
+    "isnull",
+    "gte",
+    "lte",
+)
+
+
+def _test_lookup(obj, lookup, value):
+    parts = lookup.split(LOOKUP_SEP)
+    op = parts.pop() if len(parts) > 1 and parts[-1] in _LOOKUPS else "exact"
+    meta = obj._meta
+    try:
+        if parts == ["pk"]:
+            field = meta.pk
+        elif len(parts) == 2 and parts[1] == "pk":
+            field = meta.get_field(parts[0])
+            if not field.many_to_one:
+                raise _NeedsDatabase()
+        elif len(parts) == 1:
+            field = meta.get_field(parts[0])
+            if not field.concrete or field.is_relation:
+                raise _NeedsDatabase()
+        else:
+            raise _NeedsDatabase()
+    except FieldDoesNotExist:
+        raise _NeedsDatabase()
+    return _compare_lookup(op, getattr(obj, field.attname), value, field)
+
+
+def _test_q(obj, q):
+    results = (
+        _test_q(obj, child) if isinstance(child, Q) else _test_lookup(obj, *child)
+        for child in q.children
+    )
+    result = all(results) if q.connector == Q.AND else any(results)
+    return not result if q.negated else result
 
 
 def __parser(_Q):
@@ -258,21 +645,10 @@ def __parser(_Q):
         raise Exception("No unit specified")
 
     def _make_filter_age(cond, sec):
-        import datetime
-
-        less = cond == "<"
-        p = datetime.datetime.now() - datetime.timedelta(0, sec)
-        if less:
-            q = Q(date__gte=p)
-        else:
-            q = Q(date__lte=p)
-        return q
+        return SearchAge(less=cond == "<", seconds=sec)
 
     def _make_filter_project(cond):
-        ids = Project.get_project_ids_by_name(cond)
-        return SearchTerm(
-            project=cond,
-            query=_Q(project__pk__in=ids))
+        return SearchProject(cond)
 
     def _make_filter_is(cond):
         if cond == "complete":
@@ -307,15 +683,18 @@ def __parser(_Q):
         q = _Q(name=term, **kwargs) | _Q(name__startswith=term + ".", **kwargs)
         return SearchSubquery(MessageResult, q)
 
+    NOT_SUCCESS = [x for x in Result.VALID_STATUSES if x != Result.SUCCESS]
+
     def _make_filter_result(kind, term):
         if kind == "failure:":
             return _make_subquery_result(term, status=Result.FAILURE)
         if kind == "success:":
             # What we want is "all results are successes", but the only way to
-            # express it is "there is a result and not (any result is not a success)".
-            return _make_subquery_result(term) & ~_make_subquery_result(
-                term, status__ne=Result.SUCCESS
-            )
+            # express it is "there is a success and not (any result is not a success)".
+            # Listing the other statuses lets both subqueries use the index.
+            return _make_subquery_result(
+                term, status=Result.SUCCESS
+            ) & ~_make_subquery_result(term, status__in=NOT_SUCCESS)
         if kind == "pending:":
             return _make_subquery_result(term, status=Result.PENDING)
         if kind == "running:":
@@ -358,6 +737,7 @@ def __parser(_Q):
             field('rfcmsg822id:', RemoveBrackets, 'message_id') |
             Terminal('project:').then(Word).value(_make_filter_project) |
             Terminal('subject:').then(Word).value(K) |
+            Terminal('body:').then(Word).value(SearchBody) |
             Terminal('queue:').then(Word, lambda _, q: SearchQueue([q], 'me')) |
             Maint.then(Word).value(SearchMaint) |
             (Ack | Nack | Review).then(Word, SearchQueue) |
@@ -406,7 +786,14 @@ def __parser(_Q):
     EmptySearch = Space.repeat(value=SearchTrue(), reducer=lambda x, y: x)
     return ConjunctionTerms | EmptySearch
 
-def parse(s, the_parser=__parser(Q)):
+def normalize_query(s):
+    """Collapse runs of blanks, which the parser treats as a single
+    separator, so that equivalent queries share the cached parse."""
+    return re.sub(r"[ \t]+", " ", s)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_normalized(s, the_parser=__parser(Q)):
     results = the_parser(s)
     if not isinstance(results, compynator.core.Success):
         #raise Exception("invalid search terms at '" + s + "'")
@@ -415,7 +802,13 @@ def parse(s, the_parser=__parser(Q)):
     if result.remain:
         #raise Exception("invalid search terms at '" + result.remain + "'")
         return SearchFalse()
-    return result.value
+    return plan(result.value)
+
+
+def parse(s):
+    # The expressions do not depend on the user or on the current date until
+    # get_query() or test_series() is called, so they can be shared
+    return _parse_normalized(normalize_query(s))
 
 
 class SearchEngine:
@@ -502,8 +895,8 @@ Compare the address info of message. Example:
  - Syntax: maintained-by:NAME
  - Syntax: maint:NAME
 
-NAME can be the name, email or a substring of MAINTAINERS file entries of the
-maintainer.
+NAME can be a substring of the name or email of the maintainer, as listed in
+the MAINTAINERS file.  "maint:me" looks for your email address.
 
 ---
 
@@ -570,10 +963,16 @@ The two prefixes are equivalent.
 ### Search by text
 
  - Syntax: KEYWORD
+ - Syntax: subject:KEYWORD
+ - Syntax: body:KEYWORD
 
-Search text keyword in the email message. Example:
+Search text keyword in the subject of the email message, or in the text of
+the cover letter and patches.  The keyword matches the beginning of words;
+if it has several words separated by punctuation, all of them must be
+present, in any order. Example:
 
     regression
+    body:deadlock
 
 ---
 
@@ -591,7 +990,8 @@ an "AND" using parentheses.
 """
 
     def __init__(self, terms, user):
-        self.q = reduce(operator.and_, map(lambda t: parse(t), terms), SearchTrue())
+        self.terms = [normalize_query(t) for t in terms]
+        self.q = plan(reduce(operator.and_, map(parse, self.terms), SearchTrue()))
         self.user = user
 
     def last_keywords(self):
@@ -600,28 +1000,113 @@ an "AND" using parentheses.
     def project(self):
         return self.q.get_project()
 
-    def search_series(self, queryset=None):
+    def search_series(self, queryset=None, cached=False):
+        """Return the series in @queryset (by default, all series) that
+        match the query.  If @cached is true and the user is anonymous, the
+        matching series are looked up in the search cache; in that case
+        @queryset must only include series heads."""
         if queryset is None:
-            queryset = Message.objects.series_heads()
-
-        if connection.vendor == "postgresql":
-            have_keywords = len(self.q.get_all_keywords()) > 0
-            if have_keywords:
-                queryset = queryset.annotate(
-                    subjsearch=NonNullSearchVector("subject", config="english")
-                )
-            q = self.q.get_query(
-                self.user,
-                lambda x: SearchQuery(x, config="english"),
-                lambda x: Q(subjsearch=x),
-            )
-        else:
-            q = self.q.get_query(
-                self.user, lambda x: Q(subject__icontains=x), lambda x: x
+            queryset = Message.objects.series_list()
+        if cached and not self.user.is_authenticated:
+            ids = self._get_cached_series_ids()
+            if ids is not None:
+                return queryset.filter(id__in=ids)
+        return _filter_series(queryset, self.q, self.user)
+
+    def _get_cached_series_ids(self):
+        # Lists of users and queues do not depend on who is searching if
+        # nobody is logged in, so popular searches can be shared
+        key = "search:%s:%s" % (
+            _get_search_generation(),
+            hashlib.sha1("\0".join(self.terms).encode("utf-8")).hexdigest(),
+        )
+        ids = cache.get(key)
+        if ids is None:
+            query = _filter_series(Message.objects.series_heads(), self.q, self.user)
+            ids = list(
+                query.values_list("id", flat=True)[: SEARCH_CACHE_MAX_SERIES + 1]
             )
-
-        return queryset.filter(q)
+            if len(ids) > SEARCH_CACHE_MAX_SERIES:
+                # Do not bother with an enormous IN clause
+                ids = False
+            cache.set(key, ids, SEARCH_CACHE_TIMEOUT)
+        return ids if ids is not False else None
+
+    def explain(self):
+        """Return a description of how the search is run: the plan chosen
+        for the terms, with the estimated cost of each node, followed by
+        the database's own plan for the resulting query."""
+        query = _filter_series(Message.objects.series_heads(), self.q, self.user)
+        return "\n".join(self.q.explain() + ["", query.explain()])
 
     def query_test_message(self, message):
         queryset = Message.objects.filter(id=message.id)
         return self.search_series(queryset=queryset).first()
+
+
+_SEARCH_GENERATION_KEY = "search-generation"
+
+
+def _get_search_generation():
+    return cache.get_or_set(
+        _SEARCH_GENERATION_KEY, lambda: uuid.uuid4().hex, timeout=None
+    )
+
+
+def invalidate_search_cache(event=None, **params):
+    # As with the page context, other processes only notice when the
+    # cached results expire, unless the default cache is shared
+    cache.set(_SEARCH_GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+for _event in (
+    "MessageAdded",
+    "MessageDeleted",
+    "ProjectDeleted",
+    "SeriesImported",
+    "SeriesComplete",
+    "SeriesReviewed",
+    "SeriesMerged",
+    "TagsUpdate",
+    "MaintainersUpdate",
+    "ResultUpdate",
+    "SetProperty",
+    "MessageQueued",
+    "MessageDropped",
+):
+    register_handler(_event, invalidate_search_cache)
+
+
+def _filter_series(queryset, expr, user):
+    q = expr.get_query(user, lambda x: Q(id__in=fts.match("subject", x)), lambda x: x)
+    return queryset.filter(q)
+
+
+class SeriesSnapshot:
+    """The state of a series as seen by search expressions, loaded once so
+    that many expressions can be matched with test_series() without going
+    through the database for each of them."""
+
+    def __init__(self, series):
+        # Reload the series, the caller's copy may predate the change
+        self.series = Message.objects.select_related("project__parent_project").get(
+            pk=series.pk
+        )
+        self._related = {}
+
+    @cached_property
+    def queues(self):
+        return list(
+            QueuedSeries.objects.filter(message=self.series).values_list(
+                "user_id", "user__username", "name"
+            )
+        )
+
+    def related(self, model):
+        if model not in self._related:
+            self._related[model] = list(model.objects.filter(message=self.series))
+        return self._related[model]
+
+    def test_query(self, expr, user):
+        queryset = Message.objects.filter(id=self.series.id)
+        return _filter_series(queryset, expr, user).exists()
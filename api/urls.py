@@ -38,6 +38,7 @@ router.register("users", rest.UsersViewSet)
 router.register("projects", rest.ProjectsViewSet)
 router.register("series", rest.SeriesViewSet, basename="series")
 router.register("messages", rest.MessagesViewSet)
+router.register("changes", rest.ChangesViewSet, basename="changes")
 
 projects_router = NestedDefaultRouter(
     router, "projects", lookup="projects", trailing_slash=True
@@ -13,6 +13,7 @@ from django.contrib.auth import authenticate, login, logout
 from django.http import HttpResponse, Http404
 from django.core.exceptions import PermissionDenied
 from django.conf import settings
+from django.db.models import prefetch_related_objects
 from .models import Project, Message
 import json
 from .search import SearchEngine
@@ -158,7 +159,9 @@ def prepare_series(request, s, fields=None):
     if want_field("message-id"):
         r["message-id"] = s.message_id
     if want_field("patches"):
-        r["patches"] = [prepare_patch(x) for x in s.get_patches()]
+        patches = s.get_patches()
+        prefetch_related_objects(patches, "mbox_blob")
+        r["patches"] = [prepare_patch(x) for x in patches]
     if want_field("properties"):
         # For backwards compatibility with old clients
         r["properties"] = {}
@@ -176,7 +179,7 @@ class SearchView(APIView):
 
     def handle(self, request, terms, fields=None):
         se = SearchEngine(terms, request.user)
-        r = se.search_series()
+        r = se.search_series(Message.objects.series_list(keep=("tags",)))
         return [prepare_series(request, x, fields) for x in r]
 
 
@@ -208,7 +211,9 @@ class DeleteView(APILoginRequiredView):
 
     def handle(self, request, terms=[]):
         if not terms:
-            Message.objects.all().delete()
+            Message.objects.delete_messages(
+                Message.objects.only("message_id", "project", "mbox_blob")
+            )
         else:
             se = SearchEngine(terms, request.user)
             for r in se.search_series():
@@ -11,7 +11,9 @@
 import email
 import email.utils
 import email.header
+import email.parser
 import datetime
+import io
 import re
 from rest_framework.fields import DateTimeField
 
@@ -60,13 +62,56 @@ def decode_payload(m):
             raise
 
 
+def split_mbox(data):
+    """Split a string in mbox format into the messages it contains.  A
+    string that does not start with a "From " line is taken to be a single
+    message.  Messages are separated by a "From " line at the start or
+    after a blank line; lines in the body that start with "From " are
+    escaped as ">From " (mboxrd), and one level of escaping is removed.
+    @data can also be bytes, in which case bytes are returned."""
+    if isinstance(data, bytes):
+        lines = io.BytesIO(data)
+        separator, blank_lines, escaped = b"From ", (b"\n", b"\r\n"), rb">+From "
+    else:
+        # Only split on "\n", unlike str.splitlines()
+        lines = io.StringIO(data, newline="\n")
+        separator, blank_lines, escaped = "From ", ("\n", "\r\n"), ">+From "
+    msg = []
+    blank = True
+    for line in lines:
+        if blank and line.startswith(separator):
+            if msg:
+                yield data[:0].join(msg)
+            msg = []
+            continue
+        blank = line in blank_lines
+        if re.match(escaped, line):
+            line = line[1:]
+        msg.append(line)
+    if msg:
+        yield data[:0].join(msg)
+
+
+def decode_message(raw):
+    """Return the message in the bytes @raw as a string.  Messages that
+    are not valid UTF-8 are re-encoded by the email package."""
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return email.message_from_bytes(raw).as_string()
+
+
 class MboxMessage:
     """Helper class to process mbox"""
 
     def __init__(self, m):
-        self._m = email.message_from_string(m)
+        # Only parse the headers for now, the body is parsed and decoded
+        # by get_body() the first time it is needed
+        self._m = email.parser.Parser().parsestr(m, headersonly=True)
         self._status = {}
         self._mbox = m
+        self._subject = None
+        self._body = None
 
     def get_mbox(self):
         return self._mbox
@@ -86,7 +131,9 @@ class MboxMessage:
                 t = t[t.find("]") + 1 :].strip()
             return t
 
-        r = _parse_header(self._m["subject"])
+        if self._subject is None:
+            self._subject = _parse_header(self._m["subject"])
+        r = self._subject
         if upper:
             r = r.upper()
         if strip_tags:
@@ -197,7 +244,7 @@ class MboxMessage:
 
     def get_body(self):
         def _get_message_text(m):
-            payload = m.get_payload(decode=not self._m.is_multipart())
+            payload = m.get_payload(decode=not msg.is_multipart())
             body = ""
             if m.get_content_type() == "text/plain" or m.get_content_type() == "application/octet-stream":
                 body = decode_payload(m)
@@ -206,8 +253,10 @@ class MboxMessage:
                     body += _get_message_text(p)
             return body
 
-        body = _get_message_text(self._m)
-        return body
+        if self._body is None:
+            msg = email.message_from_string(self._mbox)
+            self._body = _get_message_text(msg)
+        return self._body
 
     def get_preview(self, maxchar=1000):
         r = ""
@@ -224,6 +273,38 @@ class MboxMessage:
                 break
         return r
 
+    DIFF_STAT_PATTERNS = [
+        re.compile(p)
+        for p in [
+            r"\S*\s*\|\s*[0-9]*( \+*-*)?$",
+            r"\S*\s*\|\s*Bin",
+            r"\S* => \S*\s*|\s*[0-9]* \+*-*$",
+            r"[0-9]* files changed",
+            r"1 file changed",
+            r"(create|delete) mode [0-7]+",
+            r"mode change [0-7]+",
+            r"rename .*\([0-9]+%\)$",
+            r"copy .*\([0-9]+%\)$",
+            r"rewrite .*\([0-9]+%\)$",
+        ]
+    ]
+
+    def get_diff_stat(self):
+        cur = []
+        ret = []
+        for l in self.get_body().splitlines():
+            line = l.strip()
+            for p in self.DIFF_STAT_PATTERNS:
+                if p.match(line):
+                    cur.append(line)
+                    ret = cur
+                    break
+            else:
+                cur = []
+                if ret and re.match(r"--- \S", line):
+                    break
+        return "\n".join(ret)
+
     def _find_line(self, pattern):
         rexp = re.compile(pattern)
         for l in self.get_body().splitlines():
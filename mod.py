@@ -12,6 +12,7 @@ import imp
 import os
 import sys
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseRedirect
 from django.template import Template, Context
@@ -215,6 +216,28 @@ def get_module(name):
     return _loaded_modules.get(name)
 
 
+_RENDER_PAGE_CONTEXT_KEY = "render-page-context"
+
+
+def get_render_page_context():
+    """Return the template variables that modules add to every page with
+    render_page_context_hook.  Unlike render_page_hook, the hook cannot look
+    at the request, only at the module configuration, so its results are
+    cached until a module's configuration changes"""
+    data = cache.get(_RENDER_PAGE_CONTEXT_KEY)
+    if data is None:
+        data = {}
+        dispatch_module_hook("render_page_context_hook", context_data=data)
+        cache.set(_RENDER_PAGE_CONTEXT_KEY, data)
+    return data
+
+
+def invalidate_render_page_context():
+    # Only affects the current process unless the default cache is shared;
+    # other processes recompute the context when their entry expires
+    cache.delete(_RENDER_PAGE_CONTEXT_KEY)
+
+
 TMPL_STRING = """
 <div class="form-group">
     <label for="{{ module.name }}-input-{{ schema.name }}">{{ schema.title }}</label>
@@ -86,7 +86,7 @@ class DiffModule(PatchewModule):
         message.extra_links.append({"html": mark_safe(html), "icon": "exchange"})
 
     def _get_series_for_diff(self, q):
-        def _get_message_data(m):
+        def _filter_body(m):
             filtered = ""
             sep = ""
             for l in m.get_body().splitlines():
@@ -100,12 +100,14 @@ class DiffModule(PatchewModule):
                     l = re.sub(pat, repl, l)
                 filtered += sep + l
                 sep = "\n"
+            return filtered
 
+        def _get_message_data(m):
             return PatchInfo(
                 subject=m.subject,
                 link=m.get_message_view_url(),
                 has_replies=m.has_replies,
-                body=filtered,
+                body=m.get_cached_data("diff-body", lambda: _filter_body(m)),
             )
 
         def _add_has_replies(q, **kwargs):
@@ -153,10 +153,12 @@ Email information is configured in "INI" style:
             smtp.login(username, password)
         return smtp
 
-    def _send_series_recurse(self, sendmethod, s):
+    def _send_series_recurse(self, sendmethod, s, thread=None):
+        if thread is None:
+            thread = s.get_thread_replies()
         sendmethod(s)
-        for i in s.get_replies():
-            self._send_series_recurse(sendmethod, i)
+        for i in thread.get(s.message_id, []):
+            self._send_series_recurse(sendmethod, i, thread)
 
     def _smtp_send(self, to, cc, message):
         from_addr = self.get_config("smtp", "from")
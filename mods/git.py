@@ -19,7 +19,7 @@ from django.utils.html import format_html
 from django.utils.decorators import method_decorator
 from mod import PatchewModule, www_authenticated_op
 from event import declare_event, register_handler
-from api.models import Message, Project, Result
+from api.models import Message, Project, Result, SeriesSummary
 import api.rest
 from api.rest import PluginMethodField, SeriesSerializer, reverse_detail
 from api.views import APILoginRequiredView, prepare_series
@@ -100,6 +100,7 @@ class GitModule(PatchewModule):
         declare_event("SeriesApplied", series="the object of applied series")
         register_handler("SeriesComplete", self.on_series_update)
         register_handler("TagsUpdate", self.on_tags_update)
+        register_handler("ResultUpdate", self.on_result_update)
 
     def mark_as_pending_apply(self, series, data={}):
         r = series.git_result or series.create_result(name="git")
@@ -108,6 +109,12 @@ class GitModule(PatchewModule):
         r.data = data
         r.save()
 
+    def on_result_update(self, evt, obj, old_status, result):
+        if result.name == "git" and isinstance(obj, Message):
+            SeriesSummary.objects.update_series(
+                [obj], git_status=result.status, git_data=result.data
+            )
+
     def on_tags_update(self, event, series, **params):
         if series.is_complete:
             self.mark_as_pending_apply(
@@ -164,22 +171,19 @@ class GitModule(PatchewModule):
     def prepare_message_hook(self, request, message, for_message_view):
         if not message.is_series_head:
             return
-        # results are prefetched so do not use get_git_result()
-        rlist = [r for r in message.results.all() if r.name == "git"]
-        if not rlist:
-            return
-        r = rlist[0]
-        if r.is_completed():
-            if r.is_failure():
+        # use the summary rather than the result, which lists do not load
+        summary = message.get_summary()
+        if summary.git_status in (Result.SUCCESS, Result.FAILURE):
+            if summary.git_status == Result.FAILURE:
                 title = "Failed in applying to current master"
                 message.status_tags.append(
                     {"title": title, "type": "secondary", "char": "G"}
                 )
             else:
-                git_url = r.data.get("url")
+                git_url = summary.git_data.get("url")
                 if git_url:
-                    git_repo = r.data["repo"]
-                    git_tag = r.data["tag"]
+                    git_repo = summary.git_data["repo"]
+                    git_tag = summary.git_data["tag"]
                     message.status_tags.append(
                         {
                             "url": git_url,
@@ -300,8 +304,11 @@ class GitModule(PatchewModule):
         projects = [
             pid for pid, config in projects if match_target_repo(config, target_repo)
         ]
-        return Message.objects.filter(results__name="git", results__status="pending",
-                                      results__project__pk__in=projects)
+        return Message.objects.filter(
+            results__name="git",
+            results__status="pending",
+            results__project__pk__in=projects,
+        ).select_related("summary")
 
 
 class UnappliedSeriesSerializer(SeriesSerializer):
@@ -12,6 +12,7 @@ from collections import OrderedDict
 import re
 from django.conf.urls import url
 from django.core.exceptions import PermissionDenied
+from django.db.models import Prefetch, prefetch_related_objects
 from django.http import (
     Http404,
     HttpResponse,
@@ -22,9 +23,9 @@ from django.utils.decorators import method_decorator
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from mod import PatchewModule, www_authenticated_op
-from api.models import Message, QueuedSeries, Project, WatchedQuery
+from api.models import Message, QueuedSeries, Project, SeriesSummary, WatchedQuery
 from django.shortcuts import render
-from api.search import SearchEngine
+from api.search import SearchEngine, SeriesSnapshot, parse
 from event import declare_event, register_handler, emit_event
 from www.views import render_series_list_page
 
@@ -35,6 +36,8 @@ class MaintainerModule(PatchewModule):
     name = "maintainer"
 
     def __init__(self):
+        self._watch_index = None
+        self._watch_index_key = None
         register_handler("ResultUpdate", self.on_result_update)
         register_handler("MessageQueued", self.on_queue_change)
         register_handler("MessageDropped", self.on_queue_change)
@@ -73,18 +76,57 @@ class MaintainerModule(PatchewModule):
         query = QueuedSeries.objects.filter(user=user, message__in=msgs, name=queue)
         self._drop_all_from_queue(query)
 
-    def _update_watch_queue(self, series):
-        for wq in WatchedQuery.objects.all():
-            se = SearchEngine([wq.query], wq.user)
-            if se.query_test_message(series):
-                self._add_to_queue(wq.user, [series], "watched")
-            else:
-                self._drop_from_queue(wq.user, [series], "watched")
+    def _get_watch_index(self, watched_queries):
+        # Parse each query once and index it by the projects it can match,
+        # so that a series is only tested against the relevant queries
+        key = [(wq.id, wq.query) for wq in watched_queries]
+        if key != self._watch_index_key:
+            exprs = {}
+            by_project = {}
+            any_project = []
+            for wq_id, query in key:
+                exprs[wq_id] = parse(query)
+                projects = exprs[wq_id].get_project_names()
+                if projects is None:
+                    any_project.append(wq_id)
+                for name in projects or []:
+                    by_project.setdefault(name, []).append(wq_id)
+            self._watch_index = (exprs, by_project, any_project)
+            self._watch_index_key = key
+        return self._watch_index
+
+    def _update_watch_queue(self, series, queues_only=False):
+        watched_queries = WatchedQuery.objects.select_related("user").order_by("id")
+        watched_queries = {wq.id: wq for wq in watched_queries}
+        exprs, by_project, any_project = self._get_watch_index(watched_queries.values())
+        snapshot = SeriesSnapshot(series)
+        watching = set(
+            user_id for user_id, username, name in snapshot.queues if name == "watched"
+        )
+        project = snapshot.series.project
+        candidates = set(by_project.get(project.name, []))
+        if project.parent_project:
+            candidates.update(by_project.get(project.parent_project.name, []))
+        candidates.update(any_project)
+        # Drop series that matched an older version of the query
+        candidates.update(
+            wq.id for wq in watched_queries.values() if wq.user_id in watching
+        )
+        for wq_id in sorted(candidates):
+            expr = exprs[wq_id]
+            if queues_only and not expr.uses_queues():
+                continue
+            wq = watched_queries[wq_id]
+            matches = expr.test_series(snapshot, wq.user)
+            if matches and wq.user_id not in watching:
+                self._add_to_queue(wq.user, [snapshot.series], "watched")
+            elif not matches and wq.user_id in watching:
+                self._drop_from_queue(wq.user, [snapshot.series], "watched")
 
     def on_queue_change(self, evt, user, message, queue):
         # Handle changes to e.g. "-nack:me"
         if queue != "watched":
-            self._update_watch_queue(message)
+            self._update_watch_queue(message, queues_only=True)
 
     def on_result_update(self, evt, obj, old_status, result):
         if not isinstance(obj, Message):
@@ -143,6 +185,7 @@ class MaintainerModule(PatchewModule):
         else:
             s.is_merged = False
             s.save()
+            SeriesSummary.objects.bump_version([s])
 
     @method_decorator(www_authenticated_op)
     def www_view_mark_as_merged(self, request, project, message_id):
@@ -390,6 +433,18 @@ class MaintainerModule(PatchewModule):
             )
         )
 
+    def prepare_messages_hook(self, request, messages, for_message_view):
+        if not for_message_view or not request.user.is_authenticated:
+            return
+        prefetch_related_objects(
+            [m for m in messages if m.is_series_head],
+            Prefetch(
+                "queuedseries_set",
+                queryset=QueuedSeries.objects.filter(user=request.user),
+                to_attr="user_queues",
+            ),
+        )
+
     def prepare_message_hook(self, request, message, for_message_view):
         def link_queue(message, queue, text):
             return format_html(
@@ -444,7 +499,12 @@ class MaintainerModule(PatchewModule):
         accepted = False
         rejected = False
         queues = []
-        for r in QueuedSeries.objects.filter(user=request.user, message=message):
+        user_queues = getattr(message, "user_queues", None)
+        if user_queues is None:
+            user_queues = QueuedSeries.objects.filter(
+                user=request.user, message=message
+            )
+        for r in user_queues:
             if r.name == "accept":
                 message.extra_status.append(
                     {
@@ -11,12 +11,13 @@
 from mod import PatchewModule
 from mbox import addr_db_to_rest, parse_address
 from event import register_handler, emit_event, declare_event
-from api.models import Message
+from api.models import Message, SeriesSummary
 from api.rest import PluginMethodField
 
 from django.urls import reverse
 from django.utils.html import format_html
 
+import hashlib
 import rest_framework
 
 
@@ -57,6 +58,7 @@ series cover letter, patch mail body and their replies.
 
     def __init__(self):
         register_handler("MessageAdded", self.on_message_added)
+        register_handler("SeriesImported", self.on_series_imported)
         declare_event("TagsUpdate", series="message object that is updated")
         declare_event(
             "SeriesReviewed",
@@ -71,19 +73,26 @@ series cover letter, patch mail body and their replies.
             [x.strip() for x in tagsconfig.split(",") if x.strip()] + BUILT_IN_TAGS
         )
 
-    def update_tags(self, s):
+    def update_tags(self, s, thread=None):
         old = s.tags
-        new = self.look_for_tags(s, s)
+        new = self.look_for_tags(s, s, thread)
         if set(old) != set(new):
             s.tags = list(set(new))
             s.save()
             return True
 
-    def on_message_added(self, event, message):
+    def on_message_added(self, event, message, batch=False):
+        if batch:
+            return
         series = message.get_series_head()
         if not series:
             return
+        self.process_series(series)
+
+    def on_series_imported(self, event, series):
+        self.process_series(series)
 
+    def process_series(self, series):
         def newer_than(m1, m2):
             if m1 == m2:
                 return False
@@ -98,10 +107,11 @@ series cover letter, patch mail body and their replies.
                 return False
             return m1.date > m2.date
 
-        updated = self.update_tags(series)
+        thread = series.get_thread_replies()
+        updated = self.update_tags(series, thread)
 
         for p in series.get_patches():
-            updated = updated or self.update_tags(p)
+            updated = self.update_tags(p, thread) or updated
 
         reviewers = set()
         num_reviewed = 0
@@ -134,13 +144,31 @@ series cover letter, patch mail body and their replies.
         if updated:
             emit_event("TagsUpdate", series=series)
 
+        latest_changed = False
         if not series.topic.latest or newer_than(series, series.topic.latest):
             series.topic.latest = series
             series.topic.save()
+            latest_changed = True
+        obsoleted = []
         for m in series.get_alternative_revisions():
-            if not m.is_obsolete and m.topic.latest != m:
+            if m.id == series.topic.latest_id:
+                continue
+            if not m.is_obsolete:
                 m.is_obsolete = True
                 m.save()
+                obsoleted.append(m)
+            elif latest_changed:
+                obsoleted.append(m)
+        self.set_obsoleted_by(obsoleted, series.topic.latest)
+        if latest_changed:
+            self.set_obsoleted_by([series], None)
+
+    def set_obsoleted_by(self, series, latest):
+        SeriesSummary.objects.update_series(
+            series,
+            obsoleted_by=latest.message_id if latest else "",
+            obsoleted_by_subject=latest.subject if latest else "",
+        )
 
     def process_supersedes(self, series, tag):
         old = Message.objects.find_series_from_tag(tag, series.project)
@@ -153,31 +181,44 @@ series cover letter, patch mail body and their replies.
                 old.topic.save()
             old.is_obsolete = True
             old.save()
+            self.set_obsoleted_by([old], old.topic.latest or series)
             series.topic.merge_with(old.topic)
 
     def parse_message_tags(self, series, m, tag_prefixes):
-        r = []
-        for l in m.get_body().splitlines():
-            line = l.lower()
-            for p in tag_prefixes:
-                if line.startswith(p.lower()):
-                    if line.startswith("supersedes:"):
-                        self.process_supersedes(series, l)
-                    r.append(l)
-        return r
-
-    def _look_for_tags(self, series, m, tag_prefixes):
+        prefixes = sorted(p.lower() for p in tag_prefixes)
+
+        def find_tag_lines():
+            r = []
+            for l in m.get_body().splitlines():
+                line = l.lower()
+                for p in prefixes:
+                    if line.startswith(p):
+                        r.append(l)
+            return r
+
+        key = hashlib.sha1("\n".join(prefixes).encode("utf-8")).hexdigest()
+        r = m.get_cached_data("tags-" + key, find_tag_lines)
+        for l in r:
+            if l.lower().startswith("supersedes:"):
+                self.process_supersedes(series, l)
+        return list(r)
+
+    def _look_for_tags(self, series, m, tag_prefixes, thread):
         # Incorporate tags from non-patch replies
         r = self.parse_message_tags(series, m, tag_prefixes)
-        for x in m.get_replies():
+        for x in thread.get(m.message_id, []):
             if x.is_patch:
                 continue
-            r += self._look_for_tags(series, x, tag_prefixes)
+            r += self._look_for_tags(series, x, tag_prefixes, thread)
         return r
 
-    def look_for_tags(self, series, m):
+    def look_for_tags(self, series, m, thread=None):
+        """Collect the tags in @m and its replies; @thread is the result
+        of series.get_thread_replies(), and is fetched if not given"""
         tag_prefixes = self.get_tag_prefixes()
-        return self._look_for_tags(series, m, tag_prefixes)
+        if thread is None:
+            thread = series.get_thread_replies()
+        return self._look_for_tags(series, m, tag_prefixes, thread)
 
     def prepare_message_hook(self, request, message, for_message_view):
         if not message.is_series_head:
@@ -193,18 +234,19 @@ series cover letter, patch mail body and their replies.
                 }
             )
 
-        if message.is_obsolete and message.topic.latest:
+        summary = message.get_summary()
+        if message.is_obsolete and summary.obsoleted_by:
             latest_url = reverse(
                 "series_detail",
                 kwargs={
                     "project": message.project.name,
-                    "message_id": message.topic.latest.message_id,
+                    "message_id": summary.obsoleted_by,
                 },
             )
 
             message.status_tags.append(
                 {
-                    "title": "Has a newer version: " + message.topic.latest.subject,
+                    "title": "Has a newer version: " + summary.obsoleted_by_subject,
                     "type": "secondary",
                     "char": "O",
                     "row_class": "obsolete",
@@ -222,8 +264,8 @@ series cover letter, patch mail body and their replies.
             )
 
     def get_obsoleted_by(self, message, request, format):
-        if message.is_obsolete and message.topic.latest:
-            obsoleted_by = message.topic.latest.message_id
+        obsoleted_by = message.get_summary().obsoleted_by
+        if message.is_obsolete and obsoleted_by:
             return rest_framework.reverse.reverse(
                 "series-detail",
                 kwargs={"projects_pk": message.project.id, "message_id": obsoleted_by},
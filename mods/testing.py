@@ -11,7 +11,7 @@
 from django.conf.urls import url
 from django.http import HttpResponseForbidden, Http404, HttpResponseRedirect
 from django.core.exceptions import PermissionDenied
-from django.db.models import Q
+from django.db.models import Q, prefetch_related_objects
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.decorators import method_decorator
@@ -20,7 +20,15 @@ import datetime
 import time
 import math
 from api.views import APILoginRequiredView
-from api.models import Message, MessageResult, Project, ProjectResult, Result
+from api.models import (
+    Message,
+    MessageResult,
+    Project,
+    ProjectResult,
+    Result,
+    SeriesSummary,
+    summary_testing_status,
+)
 import api.rest
 from api.rest import PluginMethodField, TestPermission, reverse_detail
 from api.search import SearchEngine
@@ -152,6 +160,9 @@ class TestingModule(PatchewModule):
                     obj.is_tested = True
                     obj.save()
                     obj.set_property("testing.tested-base", self.get_msg_base_tags(obj))
+            if isinstance(obj, Message):
+                # after is_tested, which is also shown in series lists
+                self.update_summary(obj)
             if isinstance(obj, Project):
                 # cache the last result so that badges are not affected by RUNNING state
                 failures = obj.get_property("testing.failures", [])
@@ -175,6 +186,12 @@ class TestingModule(PatchewModule):
             if tested_base is None or tested_base != self.get_msg_base_tags(obj):
                 self.clear_and_start_testing(obj)
 
+    def update_summary(self, obj):
+        statuses = set(self.get_testing_results(obj).values_list("status", flat=True))
+        SeriesSummary.objects.update_series(
+            [obj], testing_status=summary_testing_status(statuses)
+        )
+
     def filter_testing_results(self, queryset, *args, **kwargs):
         return queryset.filter(name__startswith="testing.", *args, **kwargs)
 
@@ -190,11 +207,20 @@ class TestingModule(PatchewModule):
     def get_test_name(self, result):
         return result.name[len("testing.") :]
 
+    def delete_testing_results(self, obj, results):
+        """Delete @results; unlike saving a result, this does not emit
+        ResultUpdate, so update the summary of @obj here"""
+        for r in results:
+            r.delete()
+        if isinstance(obj, Message):
+            self.update_summary(obj)
+
     def recalc_pending_tests(self, obj):
         test_dict = self.get_tests(obj)
         all_tests = set((k for k, v in test_dict.items() if v.get("enabled", False)))
-        for r in self.get_testing_results(obj, status=Result.PENDING):
-            r.delete()
+        self.delete_testing_results(
+            obj, self.get_testing_results(obj, status=Result.PENDING)
+        )
         if len(all_tests):
             done_tests = [self.get_test_name(r) for r in self.get_testing_results(obj)]
             for tn in all_tests:
@@ -225,12 +251,9 @@ class TestingModule(PatchewModule):
             obj.is_tested = False
             obj.save()
         if test:
-            r = self.get_testing_result(obj, test)
-            if r:
-                r.delete()
+            self.delete_testing_results(obj, [self.get_testing_result(obj, test)])
         else:
-            for r in self.get_testing_results(obj):
-                r.delete()
+            self.delete_testing_results(obj, self.get_testing_results(obj))
         self.recalc_pending_tests(obj)
 
     @method_decorator(www_authenticated_op)
@@ -383,6 +406,13 @@ class TestingModule(PatchewModule):
             )
         return ret
 
+    def prepare_messages_hook(self, request, messages, for_message_view):
+        # lists use the summary instead
+        if for_message_view:
+            prefetch_related_objects(
+                [m for m in messages if m.is_series_head], "results"
+            )
+
     def prepare_message_hook(self, request, message, for_message_view):
         if not message.is_series_head:
             return
@@ -395,8 +425,7 @@ class TestingModule(PatchewModule):
             ):
                 message.extra_ops += self._build_reset_ops(message)
 
-        elif any((r.name.startswith('testing.') and r.status == Result.FAILURE
-                for r in message.results.all())):
+        elif message.get_summary().testing_status == Result.FAILURE:
             message.status_tags.append(
                 {
                     "title": "Testing failed",
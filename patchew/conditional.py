@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+"""
+Conditional GET for the pages that mirrors and bots poll
+"""
+
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+
+def conditional_response(request, make_response, etag=None, last_modified=None):
+    """Return "304 Not Modified" if the client already has the version of
+    the page that is identified by @etag and @last_modified (a naive UTC
+    datetime), otherwise call @make_response and add the validators to the
+    response.  Unlike Django's @condition decorator, the caller looks up
+    the object once and can build both the validators and the page from
+    it."""
+    if request.method not in ("GET", "HEAD"):
+        return make_response()
+    if etag is not None:
+        etag = quote_etag(etag)
+    if last_modified is not None:
+        last_modified = timegm(last_modified.utctimetuple())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+    response = make_response()
+    if response.status_code == 200:
+        if etag is not None:
+            response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+    return response
@@ -15,6 +15,8 @@ from django.views import View
 from django.http import HttpResponse, StreamingHttpResponse, Http404
 from django.utils.safestring import mark_safe
 
+from patchew.conditional import conditional_response
+
 
 class ANSIProcessor:
     RE_STRING = "[^\b\t\n\f\r\x1B]+"
@@ -526,12 +528,26 @@ if (parent.jQuery && parent.jQuery.colorbox) {
 
     def get(self, request, **kwargs):
         result = self.get_result(request, **kwargs)
-        if result is None or not result.is_completed() or result.log is None:
+        if result is None or not result.is_completed() or result.log_entry_id is None:
             raise Http404("No log found")
-        if request.GET.get("html", None) != "1":
-            return HttpResponse(result.log, content_type="text/plain; charset=utf-8")
-
-        return StreamingHttpResponse(self.generate_html(result.log))
+        html = request.GET.get("html", None) == "1"
+
+        def make_response():
+            if not html:
+                return HttpResponse(
+                    result.log, content_type="text/plain; charset=utf-8"
+                )
+            return StreamingHttpResponse(self.generate_html(result.log))
+
+        # The log entry is only loaded if the client does not have it yet
+        etag = "log-%d-%s-%s" % (
+            result.log_entry_id,
+            result.last_update.strftime("%Y%m%d%H%M%S%f"),
+            "html" if html else "text",
+        )
+        return conditional_response(
+            request, make_response, etag=etag, last_modified=result.last_update
+        )
 
 
 if __name__ == "__main__":
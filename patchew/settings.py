@@ -143,6 +143,28 @@ DEBUG, DATA_DIR, DATABASES = env_detect()
 if DATABASES["default"]["ENGINE"] == "django.db.backends.postgresql":
     INSTALLED_APPS += ["django.contrib.postgres"]
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Data derived from the message contents, see Message.get_cached_data.
+    # Entries are at most Message.MAX_CACHED_SIZE (16 KiB) long, so this
+    # cache holds at most 4096 * 16 KiB = 64 MiB in each worker process.
+    "messages": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "messages",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 4096},
+    },
+    # Rendered pieces of series pages, see www.views
+    "fragments": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "fragments",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
 # In production environments, we run in a container, behind nginx, which should
 # filter the allowed host names and block large requests. So be a little flexible here
 ALLOWED_HOSTS = ["*"]
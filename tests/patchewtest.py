@@ -17,10 +17,14 @@ import argparse
 import json
 import atexit
 import gzip
+import time
 
 import django
 import django.test as dj_test
 from django.contrib.auth.models import User, Group
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 import rest_framework.test
 
 from api.models import Message, Result, Project
@@ -52,6 +56,13 @@ class PatchewTestCase(dj_test.LiveServerTestCase):
         super().__init__(name)
         self.need_logout = False
 
+    def _pre_setup(self):
+        super()._pre_setup()
+        # Rendered fragments and search results are keyed by database ids,
+        # which are reused once the tables are flushed
+        caches["default"].clear()
+        caches["fragments"].clear()
+
     def get_tmpdir(self):
         if not hasattr(self, "_tmpdir"):
             self._tmpdir = tempfile.mkdtemp()
@@ -192,6 +203,44 @@ class PatchewTestCase(dj_test.LiveServerTestCase):
             )
         return response
 
+    def check_query_budget(
+        self,
+        url,
+        budget,
+        client=None,
+        method="get",
+        data=None,
+        status_code=200,
+        max_seconds=None,
+        **extra
+    ):
+        """Request @url and check that it runs at most @budget database
+        queries and, if given, takes at most @max_seconds.  @extra is passed
+        to the client, e.g. for request headers.  Returns the response, the
+        number of queries and the elapsed time."""
+        client = client or self.client
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as ctx:
+            resp = getattr(client, method)(url, data, **extra)
+            if resp.streaming:
+                b"".join(resp.streaming_content)
+        elapsed = time.perf_counter() - start
+        self.assertEqual(resp.status_code, status_code, url)
+        self.assertLessEqual(
+            len(ctx),
+            budget,
+            "{} ran {} queries, budget is {}:\n{}".format(
+                url, len(ctx), budget, "\n".join(q["sql"] for q in ctx)
+            ),
+        )
+        if max_seconds is not None:
+            self.assertLessEqual(
+                elapsed,
+                max_seconds,
+                "{} took {:.3f}s, budget is {}s".format(url, elapsed, max_seconds),
+            )
+        return resp, len(ctx), elapsed
+
     def create_git_repo(self, name="test-repo"):
         repo = os.path.join(self.get_tmpdir(), name)
         os.mkdir(repo)
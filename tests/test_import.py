@@ -9,7 +9,10 @@
 # http://opensource.org/licenses/MIT.
 
 
+import os
+import shutil
 import subprocess
+import tempfile
 
 from api.models import Message, Project
 
@@ -37,6 +40,59 @@ class ImportTest(PatchewTestCase):
         a = "[Qemu-devel] [PATCH] quorum: Only compile when supported\n" * 2
         self.check_cli(["search"], stdout=a.strip())
 
+    def test_import_batch(self):
+        self.check_cli(
+            [
+                "import",
+                "--batch",
+                self.get_data_path("0004-multiple-patch-reviewed.mbox.gz"),
+            ]
+        )
+        self.check_cli(
+            ["search", "-o", "subject,is_complete,is_reviewed"],
+            stdout="[Qemu-devel] [PATCH v4 0/2] Report format specific info for LUKS block driver\nTrue\nTrue",
+        )
+        self.assertEqual(Message.objects.count(), 5)
+
+    def test_import_dir_known_flag(self):
+        mbox_dir = tempfile.mkdtemp()
+        known_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, mbox_dir)
+        self.addCleanup(shutil.rmtree, known_dir)
+        for f in ["0001-simple-patch.mbox.gz", "0004-multiple-patch-reviewed.mbox.gz"]:
+            shutil.copy(self.get_data_path(f), os.path.join(mbox_dir, f[:4]))
+        a, b = self.check_cli(["import", "-j", "1", "-k", known_dir, mbox_dir])
+        self.assertEqual(a.count("[NEW]"), 6)
+        for f in os.listdir(known_dir):
+            self.assertTrue(f.startswith("known-messages"))
+        self.assertEqual(Message.objects.count(), 6)
+        self.check_cli(
+            ["search", "-o", "subject,is_complete,is_reviewed", "is:complete"],
+            stdout="[Qemu-devel] [PATCH v4 0/2] Report format specific info for LUKS block driver\nTrue\nTrue\n"
+            "[Qemu-devel] [PATCH] quorum: Only compile when supported\nTrue\nFalse",
+        )
+
+        # Everything is known now, so nothing is imported
+        a, b = self.check_cli(["import", "-k", known_dir, mbox_dir], rc=1)
+        self.assertEqual(a.count("[OLD]"), 6)
+        self.assertNotIn("[NEW]", a)
+
+    def test_import_upload_failure(self):
+        mbox_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, mbox_dir)
+        shutil.copy(
+            self.get_data_path("0001-simple-patch.mbox.gz"),
+            os.path.join(mbox_dir, "0001"),
+        )
+        with open(os.path.join(mbox_dir, "0002"), "w") as f:
+            f.write(
+                "From nobody\nTo: qemu-devel@nongnu.org\n"
+                "Subject: no message id\n\nbody\n"
+            )
+        a, b = self.check_cli(["import", mbox_dir], rc=1)
+        self.assertIn("Error in importing", a)
+        self.assertEqual(Message.objects.count(), 1)
+
     def test_non_utf_8(self):
         self.cli_import("0005-non-utf-8.mbox.gz")
 
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+import importlib.machinery
+import importlib.util
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "patchew-importer-lore"
+)
+
+
+def load_importer():
+    loader = importlib.machinery.SourceFileLoader("patchew_importer_lore", SCRIPT)
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+class FailingServer:
+    """Accept every message except those containing @bad"""
+
+    def __init__(self, bad):
+        self.bad = bad
+        self.imported = []
+
+    def import_mboxes(self, mboxes):
+        if any(self.bad in m for m in mboxes):
+            raise Exception("HTTP Error 500: Internal Server Error")
+        self.imported += mboxes
+        return len(mboxes)
+
+
+class LoreImporterTest(unittest.TestCase):
+    def setUp(self):
+        self.importer = load_importer()
+        self.importer.CONFIG["limit"] = "10.years.ago"
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.wd = os.path.join(self.tmpdir, "0")
+        self.git("init", "-q", "-bmaster", self.wd, cwd=self.tmpdir)
+        self.git("config", "user.name", "Patchew Test")
+        self.git("config", "user.email", "test@patchew.org")
+        self.commits = [self.add_message(i) for i in range(5)]
+
+    def git(self, *args, cwd=None):
+        return subprocess.check_output(
+            ["git"] + list(args), cwd=cwd or self.wd, encoding="utf-8"
+        ).strip()
+
+    def add_message(self, i):
+        with open(os.path.join(self.wd, "m"), "w") as f:
+            f.write("Message-ID: <%d@patchew.org>\nSubject: message %d\n\n" % (i, i))
+        self.git("add", "m")
+        self.git("commit", "-q", "-m", "message %d" % i)
+        return self.git("rev-parse", "HEAD")
+
+    def import_repo(self, server):
+        # Reload the watermarks as if the importer was restarted every time
+        watermarks = self.importer.Watermarks(os.path.join(self.tmpdir, "wm.json"))
+        more = self.importer.import_repo(server, watermarks, self.wd, 100)
+        return more, watermarks.get("0")
+
+    def test_skip_failing_message(self):
+        server = FailingServer("<2@patchew.org>")
+        for i in range(self.importer.MAX_FAILURES - 1):
+            self.assertEqual(self.import_repo(server), (False, self.commits[1]))
+        self.assertEqual(len(server.imported), 2)
+
+        self.assertEqual(self.import_repo(server), (False, self.commits[-1]))
+        self.assertEqual(len(server.imported), 4)
+        self.assertFalse(any("<2@patchew.org>" in m for m in server.imported))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,7 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
-from api.models import Message, WatchedQuery, QueuedSeries
+from api.models import Maintainer, Message, Result, WatchedQuery, QueuedSeries
 
 from .patchewtest import PatchewTestCase, main
 
@@ -116,6 +116,59 @@ class MaintainerQueueTest(PatchewTestCase):
         q = query.first()
         assert not q
 
+    def test_watched_maintained_by(self):
+        self.testuser.email = "Test@Example.com"
+        self.testuser.save()
+        wq = WatchedQuery(user=self.testuser, query="maint:me")
+        wq.save()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        msg = Message.objects.first()
+        url = "%sprojects/%d/series/%s/" % (
+            self.REST_BASE,
+            msg.project_id,
+            msg.message_id,
+        )
+
+        self.api_client.login(username=self.user, password=self.password)
+        maintainers = ["Test User <test@example.com>", "Kevin Wolf <kwolf@redhat.com>"]
+        resp = self.api_client.patch(url, {"maintainers": maintainers}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            set(Maintainer.objects.filter(message=msg).values_list("name", "email")),
+            {("Test User", "test@example.com"), ("Kevin Wolf", "kwolf@redhat.com")},
+        )
+
+        # The watched queue is updated when the applier reports the result
+        query = QueuedSeries.objects.filter(user=self.testuser, name="watched")
+        self.assertFalse(query.exists())
+        r = msg.git_result
+        r.status = Result.FAILURE
+        r.save()
+        self.assertEqual([q.message_id for q in query], [msg.id])
+
+        resp = self.api_client.get(self.REST_BASE + "series/", {"q": "maint:WOLF"})
+        self.assertEqual(len(resp.data["results"]), 1)
+        resp = self.api_client.get(self.REST_BASE + "series/", {"q": "maint:me"})
+        self.assertEqual(len(resp.data["results"]), 0)
+
+        maintainers = ["Kevin Wolf <kwolf@redhat.com>"]
+        resp = self.api_client.patch(url, {"maintainers": maintainers}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Maintainer.objects.filter(message=msg).count(), 1)
+        r.save()
+        self.assertFalse(query.all().exists())
+
+        # Anonymous searches are cached, but see the new maintainers
+        self.api_client.logout()
+        resp = self.api_client.get(self.REST_BASE + "series/", {"q": "maint:wolf"})
+        self.assertEqual(len(resp.data["results"]), 1)
+        self.api_client.login(username=self.user, password=self.password)
+        resp = self.api_client.patch(url, {"maintainers": []}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        self.api_client.logout()
+        resp = self.api_client.get(self.REST_BASE + "series/", {"q": "maint:wolf"})
+        self.assertEqual(len(resp.data["results"]), 0)
+
 
 if __name__ == "__main__":
     main()
@@ -98,6 +98,50 @@ Virtualization:  qemu.org | libvirt.org
         self.assertTrue("Signed-off-by" in msg.get_body())
         self.assertTrue(msg.is_patch())
 
+    def test_lazy_body(self):
+        dp = self.get_data_path("0016-nested-multipart.mbox.gz")
+        with open(dp, "r") as f:
+            msg = mbox.MboxMessage(f.read())
+        msg.get_message_id()
+        msg.get_to()
+        msg.get_prefixes()
+        self.assertIsNone(msg._body)
+        body = msg.get_body()
+        self.assertIs(msg.get_body(), body)
+        self.assertFalse(msg._m.is_multipart())
+
+    def test_split_mbox(self):
+        data = (
+            "From foo@bar Thu Jan  1 00:00:00 1970\n"
+            "Subject: one\n"
+            "\n"
+            ">From the start\n"
+            ">>From twice\n"
+            "From within a paragraph\n"
+            "form \x0c feed\u2028separator\r\n"
+            "\n"
+            "From foo@bar Thu Jan  1 00:00:00 1970\n"
+            "Subject: two\n"
+        )
+        self.assertEqual(
+            list(mbox.split_mbox(data)),
+            [
+                "Subject: one\n"
+                "\n"
+                "From the start\n"
+                ">From twice\n"
+                "From within a paragraph\n"
+                "form \x0c feed\u2028separator\r\n"
+                "\n",
+                "Subject: two\n",
+            ],
+        )
+        self.assertEqual(list(mbox.split_mbox("Subject: x\n")), ["Subject: x\n"])
+        self.assertEqual(
+            list(mbox.split_mbox(data.encode("utf-8"))),
+            [x.encode("utf-8") for x in mbox.split_mbox(data)],
+        )
+
 
 if __name__ == "__main__":
     main()
@@ -12,9 +12,13 @@ import json
 import time
 import datetime
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 from .patchewtest import PatchewTestCase, main
 
 from api.models import Message
+from mbox import split_mbox
 
 
 class MessageTest(PatchewTestCase):
@@ -64,6 +68,130 @@ class MessageTest(PatchewTestCase):
         )
         self.assertNotEqual(m1.topic, n.topic)
 
+    def test_series_completion_out_of_order(self):
+        with open(self.get_data_path("0004-multiple-patch-reviewed.mbox.gz")) as f:
+            cover, reply1, reply2, patch1, patch2 = list(split_mbox(f.read()))
+        user = self.create_user(username="importer", password="abc")
+
+        def get_head():
+            return Message.objects.get(
+                message_id="1469192015-16487-1-git-send-email-berrange@redhat.com"
+            )
+
+        Message.objects.add_message_from_mbox(patch2, user)
+        Message.objects.add_message_from_mbox(cover, user)
+        s = get_head()
+        self.assertEqual(s.num_patches, 1)
+        self.assertFalse(s.is_complete)
+        self.assertFalse(s.has_all_patches())
+
+        Message.objects.add_message_from_mbox(reply1, user)
+        s = get_head()
+        self.assertEqual(s.num_patches, 1)
+        self.assertFalse(s.is_complete)
+        self.assertIsNotNone(s.last_comment_date)
+
+        Message.objects.add_message_from_mbox(patch1, user)
+        Message.objects.add_message_from_mbox(reply2, user)
+        s = get_head()
+        self.assertEqual(s.num_patches, 2)
+        self.assertTrue(s.is_complete)
+        self.assertEqual(bytes(s.patches_received), b"\x06")
+
+        # The incremental state matches a full recount
+        s.refresh_num_patches(save=False)
+        self.assertEqual(s.num_patches, 2)
+        self.assertEqual(bytes(s.patches_received), b"\x06")
+
+    def test_thread_out_of_order(self):
+        with open(self.get_data_path("0004-multiple-patch-reviewed.mbox.gz")) as f:
+            cover, reply1, reply2, patch1, patch2 = list(split_mbox(f.read()))
+        user = self.create_user(username="importer", password="abc")
+
+        Message.objects.add_message_from_mbox(reply1, user)
+        Message.objects.add_message_from_mbox(patch1, user)
+        orphan = Message.objects.get(message_id="5792265A.5070507@redhat.com")
+        self.assertIsNone(orphan.get_series_head())
+
+        Message.objects.add_message_from_mbox(cover, user)
+        Message.objects.add_message_from_mbox(reply2, user)
+        Message.objects.add_message_from_mbox(patch2, user)
+        s = Message.objects.get(
+            message_id="1469192015-16487-1-git-send-email-berrange@redhat.com"
+        )
+        for m in Message.objects.exclude(pk=s.pk):
+            self.assertEqual(m.get_series_head(), s)
+        self.assertIsNone(s.series_head)
+
+        thread = s.get_thread_replies()
+        self.assertEqual(list(thread.keys()), [s.message_id])
+        self.assertEqual(len(thread[s.message_id]), 4)
+        self.assertEqual(len(s.get_thread_messages()), 4)
+
+    def test_orphan_reply_reconciliation(self):
+        with open(self.get_data_path("0001-simple-patch.mbox.gz")) as f:
+            patch = f.read()
+        user = self.create_user(username="importer", password="abc")
+
+        def reply(msgid, parent, date):
+            return (
+                "From: Reviewer <reviewer@example.com>\n"
+                "To: qemu-devel@nongnu.org\n"
+                "Date: %s\n"
+                "Message-ID: <%s>\n"
+                "In-Reply-To: <%s>\n"
+                "Subject: Re: [Qemu-devel] [PATCH] quorum: Only compile when supported\n"
+                "\n"
+                "Comment\n" % (date, msgid, parent)
+            )
+
+        Message.objects.add_message_from_mbox(patch, user)
+        s = Message.objects.get(topic__isnull=False)
+        old_date = s.last_reply_date
+
+        # reply2 answers reply1, which arrives later
+        reply1 = reply(
+            "reply1@example.com", s.message_id, "Mon, 1 Jan 2018 10:00:00 +0000"
+        )
+        reply2 = reply(
+            "reply2@example.com", "reply1@example.com", "Mon, 1 Jan 2018 11:00:00 +0000"
+        )
+        Message.objects.add_message_from_mbox(reply2, user)
+        s = Message.objects.get(pk=s.pk)
+        self.assertEqual(s.last_reply_date, old_date)
+        self.assertIsNone(s.last_comment_date)
+
+        Message.objects.add_message_from_mbox(reply1, user)
+        s = Message.objects.get(pk=s.pk)
+        m = Message.objects.get(message_id="reply2@example.com")
+        self.assertEqual(m.get_series_head(), s)
+        self.assertEqual(s.last_reply_date, m.date)
+        self.assertEqual(s.last_comment_date, m.date)
+
+    def test_series_list_columns(self):
+        self.cli_login()
+        self.cli_import("0004-multiple-patch-reviewed.mbox.gz")
+        self.cli_import("0001-simple-patch.mbox.gz")
+        self.cli_logout()
+
+        # Columns that the list does not show are not transferred
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get("/QEMU/")
+        self.assertContains(resp, "famz@redhat.com")
+        sql = "\n".join(q["sql"] for q in ctx.captured_queries)
+        for column in Message.objects.LIST_DEFERRED_FIELDS:
+            self.assertNotIn('"%s"' % column, sql)
+
+        # The REST API shows the recipients, but not the preview
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.api_client.get(
+                "%sprojects/%d/series/" % (self.REST_BASE, self.p.id)
+            )
+        self.assertEqual(len(resp.data["results"]), 2)
+        sql = "\n".join(q["sql"] for q in ctx.captured_queries)
+        self.assertNotIn('"preview"', sql)
+        self.assertNotIn('"patches_received"', sql)
+
 
 if __name__ == "__main__":
     main()
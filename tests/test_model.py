@@ -8,7 +8,11 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
-from api.models import Message
+from io import StringIO
+
+from django.core.management import call_command
+
+from api.models import MboxBlob, Message, Project
 
 from .patchewtest import PatchewTestCase, main
 
@@ -79,6 +83,72 @@ mode change 100644 => 100755 tests/qemu-iotests/205
         self.maxDiff = 100000
         self.assertMultiLineEqual(expected.strip(), msg.get_diff_stat())
 
+    def test_cached_data(self):
+        self.cli_import("0001-simple-patch.mbox.gz")
+        msg = Message.objects.first()
+        preview = msg.get_preview()
+        body = msg.get_body()
+
+        # A new instance gets the data from the cache without parsing
+        msg = Message.objects.first()
+        msg.get_mbox_obj = None
+        self.assertEqual(msg.get_preview(), preview)
+        self.assertEqual(msg.get_body(), body)
+
+        # Changing the contents changes the key
+        msg = Message.objects.first()
+        msg.store_mbox(msg.mbox_bytes.replace(b"quorum", b"QUORUM"))
+        msg.save()
+        msg = Message.objects.first()
+        self.assertEqual(msg.get_body(), body.replace("quorum", "QUORUM"))
+
+    def test_stored_derived_data(self):
+        self.cli_import("0008-complex-diffstat.mbox.gz")
+        msg = Message.objects.first()
+        diff_stat = msg.get_diff_stat()
+        preview = msg.get_preview()
+        self.assertEqual(msg.diff_stat, diff_stat)
+        self.assertEqual(msg.preview, preview)
+
+        # Stored values are used without parsing the message
+        msg.get_mbox_obj = None
+        self.assertEqual(msg.get_diff_stat(), diff_stat)
+        self.assertEqual(msg.get_preview(), preview)
+
+        # Rows imported before the columns existed are backfilled
+        Message.objects.update(preview=None, diff_stat=None)
+        call_command("backfill_message_data", stdout=StringIO())
+        msg = Message.objects.first()
+        self.assertEqual(msg.diff_stat, diff_stat)
+        self.assertEqual(msg.preview, preview)
+
+        # Replacing the contents recomputes them
+        msg.store_mbox(msg.mbox_bytes.replace(b"diff", b"DIFF"))
+        msg.save()
+        msg = Message.objects.first()
+        self.assertNotEqual(msg.preview, preview)
+        self.assertEqual(msg.preview, msg.get_mbox_obj().get_preview())
+        self.assertEqual(msg.diff_stat, msg.get_mbox_obj().get_diff_stat())
+
+    def test_mbox_blob(self):
+        self.cli_import("0001-simple-patch.mbox.gz")
+        msg = Message.objects.first()
+        mbox = msg.get_mbox().encode("utf-8")
+        blob = MboxBlob.objects.get()
+        self.assertEqual(blob.sha256, msg.mbox_blob_id)
+        self.assertLess(len(blob.data_xz), len(mbox))
+        self.assertEqual(b"".join(blob.iter_data(chunk_size=100)), mbox)
+
+        Message.objects.delete_subthread(msg)
+        self.assertFalse(MboxBlob.objects.exists())
+
+        # Deleting a project deletes the blobs of its messages
+        self.cli_import("0001-simple-patch.mbox.gz")
+        self.assertTrue(MboxBlob.objects.exists())
+        Project.objects.get(name="QEMU").delete()
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(MboxBlob.objects.exists())
+
 
 if __name__ == "__main__":
     main()
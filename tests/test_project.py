@@ -8,6 +8,9 @@
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
 
+from api.models import Project
+from mbox import MboxMessage
+
 from .patchewtest import PatchewTestCase, main
 
 
@@ -77,6 +80,28 @@ class ProjectTest(PatchewTestCase):
         self.assertFalse(p.maintained_by(u1))
         self.assertFalse(p.maintained_by(u2))
 
+    def test_find_projects_for_message(self):
+        tp = self.add_project("Libvirt", "libvir-list@redhat.com, other@example.com")
+        tp.prefix_tags = "!python"
+        tp.save()
+        sp = self.add_project("Libvirt-python", "libvir-list@redhat.com")
+        sp.prefix_tags = "/pyth.n"
+        sp.save()
+        self.add_project("QEMU", "qemu-devel@nongnu.org")
+        with open(self.get_data_path("0019-libvirt-python.mbox.gz"), "r") as f:
+            m = MboxMessage(f.read())
+        found = Project.find_projects_for_message(m)
+        self.assertEqual(found, [sp])
+        self.assertEqual([p for p in Project.objects.all() if p.recognizes(m)], [sp])
+
+        # The index is refreshed when a project is saved
+        sp.mailing_list = "libvirt-python@redhat.com"
+        sp.save()
+        self.assertEqual(Project.find_projects_for_message(m), [])
+        tp.prefix_tags = ""
+        tp.save()
+        self.assertEqual(Project.find_projects_for_message(m), [tp])
+
 
 if __name__ == "__main__":
     main()
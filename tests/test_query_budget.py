@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+#
+# This work is licensed under the MIT License.  Please see the LICENSE file or
+# http://opensource.org/licenses/MIT.
+
+import json
+import os
+import sys
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, resolve
+
+from api.models import Message, MessageResult, QueuedSeries, Result, WatchedQuery
+from api.search import parse
+from mod import get_module
+
+from .patchewtest import PatchewTestCase, main
+
+NUM_PROJECTS = 3
+NUM_SERIES = 8
+NUM_PATCHES = 6
+THREAD_DEPTH = 8
+# Series that also have an older, obsolete revision
+NUM_OLD_VERSIONS = 3
+
+PATCH_BODY = """
+Signed-off-by: {sender} <{addr}>
+---
+ {file} | 2 +-
+ 1 file changed, 1 insertion(+), 1 deletion(-)
+
+diff --git a/{file} b/{file}
+index 1111111..2222222 100644
+--- a/{file}
++++ b/{file}
+@@ -1 +1 @@
+-old
++new
+"""
+
+COVER_BODY = """
+This series changes {num} files.
+
+{sender} (1):
+  Change the files
+
+ {num} files changed, {num} insertions(+), {num} deletions(-)
+"""
+
+
+def make_mbox(msgid, subject, to, date, sender, body, in_reply_to=None):
+    name, addr = sender
+    day, hour, year = date
+    headers = [
+        "From: %s <%s>" % (name, addr),
+        "To: %s" % to,
+        "Subject: %s" % subject,
+        "Date: Mon, %d Jan %d %02d:00:00 +0000" % (day, year, hour),
+        "Message-Id: <%s>" % msgid,
+    ]
+    if in_reply_to:
+        headers.append("In-Reply-To: <%s>" % in_reply_to)
+        headers.append("References: <%s>" % in_reply_to)
+    return (
+        "\n".join(headers)
+        + "\n"
+        + body.format(sender=name, addr=addr, num=NUM_PATCHES, file="file.c")
+    )
+
+
+def make_series(project, n, to, version=2):
+    """Return the mboxes of a series with a cover letter, patches, reviews
+    and a long discussion thread"""
+    day = n % 28 + 1
+    year = 2016 + version
+    sender = ("Author %d" % n, "author%d@example.com" % n)
+    reviewer = ("Reviewer", "reviewer@example.com")
+    suffix = "" if version == 2 else "-v%d" % version
+    head = "%s-%d-0%s@example.com" % (project, n, suffix)
+    subject = "[PATCH v%d %%d/%d] %s: change %d" % (version, NUM_PATCHES, project, n)
+    mboxes = [make_mbox(head, subject % 0, to, (day, 0, year), sender, COVER_BODY)]
+    for i in range(1, NUM_PATCHES + 1):
+        msgid = "%s-%d-%d%s@example.com" % (project, n, i, suffix)
+        mboxes.append(
+            make_mbox(msgid, subject % i, to, (day, i, year), sender, PATCH_BODY, head)
+        )
+        review = "Reviewed-by: %s <%s>\n" % reviewer
+        mboxes.append(
+            make_mbox(
+                "review-" + msgid,
+                "Re: " + subject % i,
+                to,
+                (day, i + 1, year),
+                reviewer,
+                "\n> Patch\n\n" + review,
+                msgid,
+            )
+        )
+    parent = head
+    for i in range(THREAD_DEPTH):
+        msgid = "reply-%d-%s" % (i, head)
+        mboxes.append(
+            make_mbox(
+                msgid,
+                "Re: " + subject % 0,
+                to,
+                (day, 20, year),
+                reviewer if i % 2 else sender,
+                "\n> Quoted\n\nReply %d\n" % i,
+                parent,
+            )
+        )
+        parent = msgid
+    return head, mboxes
+
+
+class QueryBudgetTest(PatchewTestCase):
+    """Check the number of database queries run by every page on a dataset
+    with several projects, long threads and many results, so that N+1
+    query patterns do not creep back.  Set PATCHEW_QUERY_REPORT=1 to print
+    the query count and time of every request."""
+
+    # Generous, so that slow machines do not fail the test; the query
+    # counts are the real check
+    MAX_SECONDS = 10
+
+    def setUp(self):
+        self.user = self.create_superuser()
+        self.projects = []
+        self.series = {}
+        mboxes = []
+        for i in range(NUM_PROJECTS):
+            name = "Project%d" % i
+            ml = "project%d@example.com" % i
+            p = self.add_project(name, ml)
+            p.config["testing"] = {
+                "tests": {
+                    t: {
+                        "timeout": 3600,
+                        "enabled": True,
+                        "script": "#!/bin/bash\ntrue",
+                        "requirements": "",
+                    }
+                    for t in ("a", "b", "c")
+                }
+            }
+            p.save()
+            self.projects.append(p)
+            for n in range(NUM_OLD_VERSIONS):
+                mboxes += make_series(name, n, ml, version=1)[1]
+            for n in range(NUM_SERIES):
+                head, series = make_series(name, n, ml)
+                self.series.setdefault(p.id, []).append(head)
+                mboxes += series
+        WatchedQuery.objects.create(user=self.user, query="is:reviewed")
+        Message.objects.add_messages_from_mboxes(mboxes)
+
+        # Complete the results of most series, with logs.  Testing starts
+        # when git results succeed, so do those first
+        def series_num(r):
+            return int(r.message.message_id.split("-")[1])
+
+        for r in MessageResult.objects.filter(name="git").select_related("message"):
+            n = series_num(r)
+            if n == NUM_SERIES - 1:
+                continue
+            r.log = "git log\n" * 100
+            if n == NUM_SERIES - 2:
+                r.status = Result.FAILURE
+            else:
+                r.status = Result.SUCCESS
+                r.data = {"repo": "https://example.com/repo", "tag": "patchew/%d" % n}
+            r.save()
+        for r in MessageResult.objects.exclude(name="git").select_related("message"):
+            if series_num(r) == NUM_SERIES - 3:
+                continue
+            r.log = "testing log\n" * 100
+            r.status = Result.FAILURE if r.name == "testing.b" else Result.SUCCESS
+            r.data = {"head": "0123456789abcdef"}
+            r.save()
+        for p in self.projects:
+            r = p.create_result(name="git", status=Result.SUCCESS)
+            r.log = "project log\n"
+            r.save()
+            for head in self.series[p.id][:3]:
+                QueuedSeries.objects.create(
+                    user=self.user,
+                    message=Message.objects.get(project=p, message_id=head),
+                    name="todo",
+                )
+
+        self.client.login(username=self.user.username, password=self.password)
+        self.addCleanup(self.client.logout)
+        self.api_client.force_authenticate(self.user)
+        self.addCleanup(self.api_client.force_authenticate, None)
+
+    def get_urls(self):
+        """Return a list of (method, url, data, budget, status_code)"""
+        p = self.projects[0]
+        s = self.series[p.id][0]
+        s2 = self.series[p.id][1]
+        patch = s.replace("-0@", "-1@")
+        rest = "/api/v1/"
+        pr = "%sprojects/%d/" % (rest, p.id)
+        ps = "%sseries/%s/" % (pr, s)
+        legacy_search = {"params": json.dumps({"terms": ["project:" + p.name]})}
+        return [
+            # www
+            ("get", "/", None, 6, 200),
+            ("get", "/login/", None, 2, 200),
+            ("get", "/change-password/", None, 2, 200),
+            ("get", "/search?q=is:reviewed", None, 5, 200),
+            ("get", "/search-help", None, 2, 200),
+            ("get", "/%s/" % p.name, None, 7, 200),
+            ("get", "/%s/?sort=replied" % p.name, None, 7, 200),
+            ("get", "/%s/info" % p.name, None, 10, 200),
+            ("get", "/%s/logs/git/" % p.name, None, 3, 200),
+            ("get", "/%s/%s/logs/git/" % (p.name, s), None, 7, 200),
+            ("get", "/%s/%s/" % (p.name, s), None, 15, 200),
+            ("get", "/%s/%s/%s/" % (p.name, s, patch), None, 18, 200),
+            ("get", "/%s/%s/mbox" % (p.name, s), None, 7, 200),
+            ("get", "/%s/%s/diff/%s/" % (p.name, s, s2), None, 20, 200),
+            ("get", "/%s/badge.svg" % p.name, None, 1, 302),
+            ("get", "/my-queues/", None, 4, 200),
+            ("get", "/my-queues/%s/" % p.name, None, 5, 200),
+            ("get", "/my-queues/%s/todo/" % p.name, None, 7, 200),
+            ("get", "/my-queues/%s/todo/mbox" % p.name, None, 14, 200),
+            # legacy API
+            ("post", "/api/version/", None, 0, 200),
+            ("post", "/api/get-projects/", None, 1, 200),
+            ("post", "/api/search/", legacy_search, 24, 200),
+            # REST
+            ("get", rest, None, 0, 200),
+            ("get", rest + "users/", None, 1, 200),
+            ("get", "%susers/%d/" % (rest, self.user.id), None, 1, 200),
+            ("get", rest + "projects/", None, 1, 200),
+            ("get", pr, None, 4, 200),
+            ("get", pr + "config/", None, 4, 200),
+            ("get", rest + "projects/by-name/%s/" % p.name, None, 1, 307),
+            ("get", rest + "series/", None, 1, 200),
+            ("get", rest + "series/unapplied/", None, 8, 200),
+            ("get", rest + "series/explain/?q=failure:git", None, 2, 200),
+            ("get", rest + "messages/", None, 1, 200),
+            ("get", rest + "changes/", None, 1, 200),
+            ("get", pr + "results/", None, 8, 200),
+            ("get", pr + "results/git/", None, 7, 200),
+            ("get", pr + "series/", None, 6, 200),
+            ("get", pr + "series/explain/?q=failure:git", None, 4, 200),
+            ("get", ps, None, 10, 200),
+            ("get", ps + "mbox/", None, 8, 200),
+            ("get", ps + "results/", None, 12, 200),
+            ("get", ps + "results/testing.a/", None, 8, 200),
+            ("get", pr + "messages/", None, 6, 200),
+            ("get", "%smessages/%s/" % (pr, patch), None, 6, 200),
+            ("get", "%smessages/%s/mbox/" % (pr, patch), None, 5, 200),
+            ("get", "%smessages/%s/replies/" % (pr, patch), None, 7, 200),
+        ]
+
+    # Routes that only change data, plus the catch-all of the legacy API
+    # and the schema, which do not depend on the contents of the database
+    NOT_MEASURED = [
+        "logout/$",
+        "login/$",
+        "change-password/done/$",
+        "get-test/$",
+        "update_project_head/$",
+        "messages/import/$",
+        "schema/$",
+        "git-reset/(?P<series>.*)/",
+        "testing-reset/",
+        "mark-as-merged/",
+        "clear-merged/",
+        "mark-as-accepted/",
+        "mark-as-rejected/",
+        "clear-reviewed/",
+        "add-to-queue/",
+        "drop-from-queue/(?P<queue>[^/]*)/",
+        "/remove/",
+        "watch-query/$",
+        "email-bounce/(?P<message_id>.*)/",
+        "api/add-project/",
+        "api/update-project-head/",
+        "api/import/",
+        "api/delete/",
+        "api/testing-get/",
+        "api/testing-report/",
+        "api/testing-capabilities/",
+        "api/untest/",
+        "api/logout/",
+        "api/login/",
+        "api/.*",
+    ]
+
+    def test_query_budget(self):
+        report = []
+        for method, url, data, budget, status_code in self.get_urls():
+            client = self.api_client if "/api/v1/" in url else self.client
+            with self.subTest(url=url):
+                resp, queries, elapsed = self.check_query_budget(
+                    url,
+                    budget,
+                    client=client,
+                    method=method,
+                    data=data,
+                    status_code=status_code,
+                    max_seconds=self.MAX_SECONDS,
+                )
+                report.append((queries, elapsed, method.upper(), url))
+        if os.environ.get("PATCHEW_QUERY_REPORT"):
+            for queries, elapsed, method, url in report:
+                sys.stderr.write(
+                    "\n%5d queries %8.3fs %s %s" % (queries, elapsed, method, url)
+                )
+            sys.stderr.write("\n")
+
+    def test_series_list_rows(self):
+        """The number of queries for a series list must not depend on the
+        number of rows"""
+        p = self.projects[0]
+        url = "/%s/" % p.name
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        # Add newer versions of all series, so that the page has twice the
+        # rows and the older ones are obsolete
+        mboxes = []
+        for n in range(NUM_SERIES):
+            mboxes += make_series(p.name, n, p.mailing_list, version=3)[1]
+        Message.objects.add_messages_from_mboxes(mboxes)
+        resp, queries, elapsed = self.check_query_budget(url, len(ctx))
+        self.assertContains(
+            resp, "Has a newer version", count=NUM_SERIES + NUM_OLD_VERSIONS
+        )
+
+    def test_fragment_cache(self):
+        """Anonymous series pages are served from the fragment cache until
+        something in the series changes"""
+        self.client.logout()
+        p = self.projects[0]
+        s = Message.objects.get(project=p, message_id=self.series[p.id][0])
+        list_url = "/%s/" % p.name
+        url = "/%s/%s/" % (p.name, s.message_id)
+        failed = "Failed in applying to current master"
+        failed_rows = self.client.get(list_url).content.decode().count(failed)
+        self.assertNotContains(self.client.get(url), failed)
+        # Only the project, the series and its summary are looked up
+        self.check_query_budget(url, 5)
+
+        # The cached response keeps the headers of the original one
+        resp = self.client.get(url)
+        self.assertEqual(resp["Content-Type"], "text/html; charset=utf-8")
+        self.assertIn("Cookie", resp["Vary"])
+
+        r = s.git_result
+        r.status = Result.FAILURE
+        r.save()
+        self.assertContains(self.client.get(url), failed)
+        self.assertContains(self.client.get(list_url), failed, count=failed_rows + 1)
+
+        # The rows link to the series pages, which include the project name
+        p.name = "Renamed"
+        p.save()
+        self.assertContains(self.client.get("/Renamed/"), "/Renamed/%s/" % s.message_id)
+
+    def test_conditional_get(self):
+        """Pages that bots poll answer 304 without loading their contents
+        when the client has the current version"""
+        self.client.logout()
+        p = self.projects[0]
+        s = Message.objects.get(project=p, message_id=self.series[p.id][0])
+        patch = s.message_id.replace("-0@", "-1@")
+        pr = "/api/v1/projects/%d/" % p.id
+        urls = [
+            ("/%s/%s/mbox" % (p.name, s.message_id), 6),
+            ("/%s/%s/mbox" % (p.name, patch), 6),
+            ("/%s/%s/" % (p.name, s.message_id), 5),
+            ("/%s/%s/logs/git/" % (p.name, s.message_id), 6),
+            ("/%s/%s/logs/git/?html=1" % (p.name, s.message_id), 6),
+            ("%sseries/%s/mbox/" % (pr, s.message_id), 4),
+            ("%smessages/%s/mbox/" % (pr, patch), 4),
+        ]
+        for url, budget in urls:
+            with self.subTest(url=url):
+                resp = self.client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("ETag", resp)
+                self.check_query_budget(
+                    url, budget, status_code=304, HTTP_IF_NONE_MATCH=resp["ETag"]
+                )
+                if resp.has_header("Last-Modified"):
+                    self.check_query_budget(
+                        url,
+                        budget,
+                        status_code=304,
+                        HTTP_IF_MODIFIED_SINCE=resp["Last-Modified"],
+                    )
+
+        # A new result log changes the ETag
+        url = "/%s/%s/logs/git/" % (p.name, s.message_id)
+        etag = self.client.get(url)["ETag"]
+        r = s.git_result
+        r.log = "new git log\n"
+        r.save()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(resp, "new git log")
+        self.assertNotEqual(resp["ETag"], etag)
+
+    def test_watched_queries(self):
+        """Watched queries are matched in memory, so updating the watched
+        queues does not cost more queries as the number of watchers grows"""
+        p = self.projects[0]
+        heads = [
+            Message.objects.get(project=p, message_id=m) for m in self.series[p.id]
+        ]
+
+        def count_merge_queries(s):
+            with CaptureQueriesContext(connection) as ctx:
+                s.set_merged()
+            return len(ctx)
+
+        def add_watchers(first, last):
+            other = self.projects[1].name
+            for i in range(first, last):
+                user = self.create_user("watcher%d" % i)
+                for q in (
+                    "project:%s is:merged" % other,
+                    "from:nobody@example.com age:<1w",
+                    "{to:nobody@example.com failure:git} -nack:me",
+                ):
+                    WatchedQuery.objects.create(user=user, query=q)
+
+        add_watchers(0, 1)
+        count_merge_queries(heads[0])
+        queries = count_merge_queries(heads[1])
+        add_watchers(1, 20)
+        count_merge_queries(heads[2])
+        self.assertEqual(count_merge_queries(heads[3]), queries)
+
+        user = self.create_user("watcher")
+        WatchedQuery.objects.create(user=user, query="project:%s is:merged" % p.name)
+        heads[4].set_merged()
+        watched = QueuedSeries.objects.filter(user=user, name="watched")
+        self.assertEqual([q.message_id for q in watched], [heads[4].id])
+
+    def test_search_cache(self):
+        """Anonymous searches are parsed once and their results are reused
+        until something changes"""
+        self.assertIs(parse("is:complete  is:tested"), parse("is:complete is:tested"))
+        self.client.logout()
+        p = self.projects[0]
+        url = "/search?q=failure:git+project:%s" % p.name
+        failed = "Failed in applying to current master"
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertContains(self.client.get(url), failed, count=1)
+        self.check_query_budget(url, len(ctx) - 1)
+
+        s = Message.objects.get(project=p, message_id=self.series[p.id][0])
+        r = s.git_result
+        r.status = Result.FAILURE
+        r.save()
+        self.assertContains(self.client.get(url), failed, count=2)
+
+    def test_render_page_context(self):
+        """The context that modules add to every page is only computed
+        again when their configuration changes"""
+        footer = get_module("footer").get_model()
+        footer.config = "<p>Footer 1</p>"
+        footer.save()
+        self.assertContains(self.client.get("/"), "Footer 1")
+        self.check_query_budget("/search-help", 2)
+        footer.config = "<p>Footer 2</p>"
+        footer.save()
+        self.assertContains(self.client.get("/search-help"), "Footer 2")
+
+    def test_all_urls_measured(self):
+        def walk(resolver, prefix=""):
+            for p in resolver.url_patterns:
+                # same as ResolverMatch.route
+                route = str(p.pattern)
+                if prefix and route.startswith("^"):
+                    route = route[1:]
+                route = prefix + route
+                if hasattr(p, "url_patterns"):
+                    yield from walk(p, route)
+                else:
+                    yield route
+
+        measured = set(
+            resolve(url.split("?")[0]).route for m, url, *rest in self.get_urls()
+        )
+        for route in walk(get_resolver()):
+            if route.startswith(("^admin/", "^__debug__/", "^static/", "^media/")):
+                continue
+            if route in measured or route.endswith(tuple(self.NOT_MEASURED)):
+                continue
+            self.fail("No query budget for " + route)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,9 @@ from collections import OrderedDict
 import json
 
 from django.contrib.auth.models import User
+from django.db import transaction
 
-from api.models import Message
+from api.models import MboxBlob, Message, Result
 from api.rest import AddressSerializer
 
 from .patchewtest import PatchewTestCase, main
@@ -379,6 +380,128 @@ class RestTest(PatchewTestCase):
         resp = self.api_client.get(self.REST_BASE + "projects/12345/series/")
         self.assertEqual(resp.status_code, 404)
 
+    def test_series_list_cursor(self):
+        self.cli_login()
+        for f in (
+            "0001-simple-patch.mbox.gz",
+            "0004-multiple-patch-reviewed.mbox.gz",
+            "0013-foo-patch.mbox.gz",
+            "0014-bar-patch.mbox.gz",
+            "0008-complex-diffstat.mbox.gz",
+        ):
+            self.cli_import(f)
+        self.cli_logout()
+        # Exercise ties and NULLs in the ordering columns
+        heads = list(Message.objects.series_heads().order_by("id"))
+        Message.objects.filter(id=heads[1].id).update(date=heads[0].date)
+        Message.objects.filter(id=heads[2].id).update(last_reply_date=None)
+
+        def walk(url):
+            ids = []
+            while url:
+                resp = self.api_client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                ids += [r["message_id"] for r in resp.data["results"]]
+                url = resp.data["next"]
+            return ids
+
+        for ordering in ("", "&ordering=date", "&ordering=last_reply_date"):
+            with self.subTest(ordering=ordering):
+                url = self.PROJECT_BASE + "series/?limit=2" + ordering
+                by_offset = walk(url)
+                self.assertEqual(len(by_offset), len(heads))
+                self.assertEqual(walk(url + "&cursor="), by_offset)
+
+        resp = self.api_client.get(self.PROJECT_BASE + "series/?cursor=foo")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_changes(self):
+        self.cli_login()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        self.cli_logout()
+        s = Message.objects.series_heads().get()
+        resp = self.api_client.get(self.REST_BASE + "changes/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["next"], None)
+        changes = resp.data["results"]
+        self.assertIn("MessageAdded", [c["event"] for c in changes])
+        seq = changes[-1]["seq"]
+
+        s.set_merged()
+        with transaction.atomic():
+            r = s.create_result(name="git", status=Result.SUCCESS)
+            r.save()
+            # Not numbered nor visible until the transaction commits
+            resp = self.api_client.get(self.REST_BASE + "changes/?since=%d" % seq)
+            self.assertEqual(
+                [c["event"] for c in resp.data["results"]], ["SeriesMerged"]
+            )
+        resp = self.api_client.get(self.REST_BASE + "changes/?since=%d" % seq)
+        changes = resp.data["results"]
+        self.assertEqual(
+            [(c["event"], c["name"]) for c in changes],
+            [("SeriesMerged", ""), ("ResultUpdate", "git")],
+        )
+        self.assertEqual(changes[0]["message_id"], s.message_id)
+        self.assertEqual(
+            changes[0]["message"],
+            "%smessages/%s/" % (self.PROJECT_BASE, s.message_id),
+        )
+        self.assertEqual(changes[0]["project"], self.PROJECT_BASE)
+
+        # Walk the feed one change at a time
+        url = self.REST_BASE + "changes/?limit=1&since=%d" % seq
+        resp = self.api_client.get(url)
+        self.assertEqual(resp.data["results"], changes[:1])
+        resp = self.api_client.get(resp.data["next"])
+        self.assertEqual(resp.data["results"], changes[1:])
+
+    def test_changes_delete(self):
+        self.cli_login()
+        self.cli_import("0004-multiple-patch-reviewed.mbox.gz")
+        self.cli_logout()
+        s = Message.objects.series_heads().get()
+        thread = set(Message.objects.values_list("message_id", flat=True))
+        resp = self.api_client.get(self.REST_BASE + "changes/")
+        seq = resp.data["results"][-1]["seq"]
+
+        self.api_client.login(username=self.user, password=self.password)
+        resp = self.api_client.delete(
+            "%sseries/%s/" % (self.PROJECT_BASE, s.message_id)
+        )
+        self.assertEqual(resp.status_code, 204)
+        self.api_client.logout()
+        resp = self.api_client.get(self.REST_BASE + "changes/?since=%d" % seq)
+        changes = resp.data["results"]
+        self.assertEqual(set(c["event"] for c in changes), {"MessageDeleted"})
+        self.assertEqual(set(c["message_id"] for c in changes), thread)
+        for c in changes:
+            self.assertEqual(c["project"], self.PROJECT_BASE)
+            self.assertIsNone(c["message"])
+
+        # Older changes of the deleted messages are kept
+        resp = self.api_client.get(self.REST_BASE + "changes/")
+        added = [c for c in resp.data["results"] if c["event"] == "MessageAdded"]
+        self.assertEqual(set(c["message_id"] for c in added), thread)
+        self.assertIsNone(added[0]["message"])
+
+        seq = changes[-1]["seq"]
+        project_id = self.p.id
+        self.p.delete()
+        resp = self.api_client.get(
+            self.REST_BASE + "changes/?since=%d&project=%d" % (seq, project_id)
+        )
+        self.assertEqual(
+            [(c["event"], c["project"]) for c in resp.data["results"]],
+            [("ProjectDeleted", self.PROJECT_BASE)],
+        )
+        self.assertEqual(resp.data["next"], None)
+
+        resp = self.api_client.get(self.REST_BASE + "changes/?project=%d" % self.p2.id)
+        self.assertEqual(resp.data["results"], [])
+        resp = self.api_client.get(self.REST_BASE + "changes/?since=foo")
+        self.assertEqual(resp.status_code, 400)
+
     def test_series_results_list(self):
         resp1 = self.apply_and_retrieve(
             "0001-simple-patch.mbox.gz",
@@ -409,6 +532,32 @@ class RestTest(PatchewTestCase):
         self.assertEqual("replies" in resp.data["results"][0], False)
         self.assertEqual("patches" in resp.data["results"][0], False)
 
+        resp = self.api_client.get(self.REST_BASE + "series/?q=body:exceptional")
+        self.assertEqual(len(resp.data["results"]), 1)
+        self.assertEqual(
+            resp.data["results"][0]["resource_uri"], resp2.data["resource_uri"]
+        )
+        # all words must be present, but not necessarily next to each other
+        resp = self.api_client.get(
+            self.REST_BASE + "series/?q=body:exceptional,consistency"
+        )
+        self.assertEqual(len(resp.data["results"]), 1)
+        self.assertEqual(
+            resp.data["results"][0]["resource_uri"], resp2.data["resource_uri"]
+        )
+        resp = self.api_client.get(self.REST_BASE + "series/?q=body:except,consist")
+        self.assertEqual(len(resp.data["results"]), 1)
+        resp = self.api_client.get(
+            self.REST_BASE + "series/?q=body:exceptional,deadlock"
+        )
+        self.assertEqual(len(resp.data["results"]), 0)
+        # only in the body of a patch
+        resp = self.api_client.get(self.REST_BASE + "series/?q=body:QCryptoBlockInfo")
+        self.assertEqual(len(resp.data["results"]), 1)
+        self.assertEqual(
+            resp.data["results"][0]["resource_uri"], resp1.data["resource_uri"]
+        )
+
         resp = self.api_client.get(self.REST_BASE + "series/?q=project:QEMU")
         self.assertEqual(len(resp.data["results"]), 2)
 
@@ -432,6 +581,64 @@ class RestTest(PatchewTestCase):
         )
         self.assertEqual(resp.status_code, 404)
 
+    def test_series_search_results(self):
+        resp1 = self.apply_and_retrieve(
+            "0004-multiple-patch-reviewed.mbox.gz",
+            self.p.id,
+            "1469192015-16487-1-git-send-email-berrange@redhat.com",
+        )
+        resp2 = self.apply_and_retrieve(
+            "0001-simple-patch.mbox.gz",
+            self.p.id,
+            "20160628014747.20971-1-famz@redhat.com",
+        )
+        s1 = Message.objects.get(message_id=resp1.data["message_id"])
+        s2 = Message.objects.get(message_id=resp2.data["message_id"])
+        s1.create_result(name="check.a", status=Result.SUCCESS).save()
+        s1.create_result(name="check.b", status=Result.SUCCESS).save()
+        s2.create_result(name="check.a", status=Result.SUCCESS).save()
+        s2.create_result(name="check.b", status=Result.FAILURE).save()
+
+        def search(q):
+            resp = self.api_client.get(self.REST_BASE + "series/", {"q": q})
+            return set(x["resource_uri"] for x in resp.data["results"])
+
+        s1_uri = resp1.data["resource_uri"]
+        s2_uri = resp2.data["resource_uri"]
+        self.assertEqual(search("success:check"), {s1_uri})
+        self.assertEqual(search("failure:check project:QEMU"), {s2_uri})
+        self.assertEqual(search("project:QEMU success:check.a"), {s1_uri, s2_uri})
+        self.assertEqual(search("{project:QEMU failure:check} quorum"), {s2_uri})
+        self.assertEqual(search("-success:check project:QEMU"), {s2_uri})
+        self.assertEqual(search("project:nonexistent failure:check"), set())
+
+    def test_series_search_explain(self):
+        url = self.REST_BASE + "series/explain/"
+        q = {"q": "maint:kwolf success:git age:<1w project:QEMU"}
+        self.assertEqual(self.api_client.get(url, q).status_code, 401)
+        self.api_client.login(username=self.user, password=self.password)
+        resp = self.api_client.get(url, q)
+        self.assertEqual(resp.status_code, 200)
+        plan = resp.content.decode().splitlines()
+        self.assertEqual(plan[0].split()[0], "AND")
+        self.assertEqual(
+            {plan[1].strip(), plan[2].strip()},
+            {"project QEMU  (cost=1)", "age < 604800s  (cost=1)"},
+        )
+        self.assertTrue(plan[3].strip().startswith("EXISTS MessageResult"))
+        self.assertIn("in project QEMU", plan[3])
+        self.assertEqual(plan[4].strip(), "NOT  (cost=4)")
+        self.assertIn("in project QEMU", plan[5])
+        self.assertTrue(plan[6].strip().startswith("maintained by kwolf"))
+        self.api_client.logout()
+
+        # The plan covers all projects, so project maintainers cannot see it
+        test = self.create_user(username="test", password="userpass")
+        self.p.maintainers.set([test])
+        self.api_client.login(username="test", password="userpass")
+        for url in (url, self.PROJECT_BASE + "series/explain/"):
+            self.assertEqual(self.api_client.get(url, q).status_code, 403)
+
     def test_series_delete(self):
         test_message_id = "1469192015-16487-1-git-send-email-berrange@redhat.com"
         series = self.apply_and_retrieve(
@@ -482,6 +689,18 @@ class RestTest(PatchewTestCase):
         self.assertEqual(resp_after.status_code, 404)
         self.assertEqual(resp_reply_after.status_code, 404)
 
+    def test_message_delete(self):
+        self.cli_login()
+        self.cli_import("0001-simple-patch.mbox.gz")
+        message_id = "20160628014747.20971-1-famz@redhat.com"
+        self.api_client.login(username=self.user, password=self.password)
+        resp = self.api_client.delete(
+            self.PROJECT_BASE + "messages/" + message_id + "/"
+        )
+        self.assertEqual(resp.status_code, 204)
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(MboxBlob.objects.exists())
+
     def test_create_message(self):
         dp = self.get_data_path("0022-another-simple-patch.json.gz")
         with open(dp, "r") as f:
@@ -619,6 +838,12 @@ class RestTest(PatchewTestCase):
             + "messages/20180223132311.26555-2-marcandre.lureau@redhat.com/"
         )
         self.assertEqual(resp_get2.status_code, 200)
+        # The copies in the two projects share the mbox
+        blobs = Message.objects.filter(
+            message_id="20180223132311.26555-2-marcandre.lureau@redhat.com"
+        ).values_list("mbox_blob", flat=True)
+        self.assertEqual(len(blobs), 2)
+        self.assertEqual(blobs[0], blobs[1])
 
     def test_without_login_create_message(self):
         dp = self.get_data_path("0022-another-simple-patch.json.gz")
@@ -700,6 +925,68 @@ class RestTest(PatchewTestCase):
         )
         self.assertEqual(resp_get2.status_code, 200)
 
+    def test_import_mboxes(self):
+        dp = self.get_data_path("0004-multiple-patch-reviewed.mbox.gz")
+        with open(dp, "r") as f:
+            data = f.read()
+        self.api_client.login(username=self.user, password=self.password)
+        resp = self.api_client.post(
+            self.REST_BASE + "messages/import/", data, content_type="application/mbox"
+        )
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data["count"], 5)
+        self.assertEqual(resp.data["projects"], [self.PROJECT_BASE])
+        resp = self.api_client.get(
+            self.PROJECT_BASE
+            + "series/1469192015-16487-1-git-send-email-berrange@redhat.com/"
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["num_patches"], 2)
+        self.assertTrue(resp.data["is_complete"])
+        self.assertTrue(resp.data["is_reviewed"])
+        self.assertEqual(len(resp.data["replies"]), 2)
+
+        resp = self.api_client.post(
+            self.REST_BASE + "messages/import/", data, content_type="application/mbox"
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["count"], 0)
+
+    def test_import_mboxes_non_utf_8(self):
+        # Each message can have its own encoding
+        data = b""
+        for fn in ("0001-simple-patch.mbox.gz", "0005-non-utf-8.mbox.gz"):
+            with open(self.get_data_path(fn), "rb") as f:
+                data += b"From nobody Thu Jan  1 00:00:00 1970\n" + f.read() + b"\n"
+        self.api_client.login(username=self.user, password=self.password)
+        resp = self.api_client.post(
+            self.REST_BASE + "messages/import/", data, content_type="application/mbox"
+        )
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data["count"], 2)
+        self.assertTrue(
+            Message.objects.filter(message_id="20160803231737.GA7257@flamenco").exists()
+        )
+
+    def test_non_maintainer_import_mboxes(self):
+        test = self.create_user(username="test", password="userpass")
+        self.api_client.login(username="test", password="userpass")
+        self.p2.maintainers.set([test])
+        dp = self.get_data_path("0023-multiple-project-patch.mbox.gz")
+        with open(dp, "r") as f:
+            data = f.read()
+        resp = self.api_client.post(
+            self.REST_BASE + "messages/import/", {"mboxes": [data]}, format="json"
+        )
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data["count"], 1)
+        self.assertEqual(resp.data["projects"], [self.PROJECT_BASE_2])
+        resp_get = self.api_client.get(
+            self.PROJECT_BASE
+            + "messages/20180223132311.26555-2-marcandre.lureau@redhat.com/"
+        )
+        self.assertEqual(resp_get.status_code, 404)
+
     def test_message(self):
         series = self.apply_and_retrieve(
             "0001-simple-patch.mbox.gz",
@@ -720,7 +1007,10 @@ class RestTest(PatchewTestCase):
 
         message = series.data["patches"][0]["resource_uri"]
         resp = self.client.get(message + "mbox/")
-        self.assertEqual(resp.data, Message.objects.all()[0].get_mbox())
+        self.assertEqual(
+            b"".join(resp.streaming_content).decode("utf-8"),
+            Message.objects.all()[0].get_mbox(),
+        )
 
     def test_address_serializer(self):
         data1 = {"name": "Shubham", "address": "shubhamjain7495@gmail.com"}
@@ -90,6 +90,9 @@ class ImportTest(PatchewTestCase):
         m1 = Message.objects.find_series(old_id, self.p.name)
         m2 = Message.objects.find_series(new_id, self.p.name)
         self.assertEqual(m1.topic, m2.topic)
+        self.assertEqual(m1.get_summary().obsoleted_by, new_id)
+        self.assertEqual(m1.get_summary().obsoleted_by_subject, m2.subject)
+        self.assertEqual(m2.get_summary().obsoleted_by, "")
 
         resp = self.api_client.get(self.PROJECT_BASE + "series/" + old_id + "/")
         self.assertEqual(
@@ -371,6 +371,8 @@ class TestingResetTest(PatchewTestCase):
             },
         )
         self.assertTrue(msg.is_tested)
+        self.assertEqual(msg.get_summary().git_status, Result.SUCCESS)
+        self.assertEqual(msg.get_summary().testing_status, Result.FAILURE)
 
         self.api_login()
         self.client.post("/login/", {"username": self.user, "password": self.password})
@@ -400,6 +402,8 @@ class TestingResetTest(PatchewTestCase):
             },
         )
         self.assertFalse(msg.is_tested)
+        msg = Message.objects.all()[0]
+        self.assertEqual(msg.get_summary().testing_status, Result.PENDING)
 
 
 class TestingDisableTest(PatchewTestCase):
@@ -415,12 +419,19 @@ class TestingDisableTest(PatchewTestCase):
         self.cli_login()
         self.cli_import("0013-foo-patch.mbox.gz")
         self.do_apply()
+        msg = Message.objects.all()[0]
+        self.assertEqual(msg.get_summary().testing_status, Result.PENDING)
         self.p1.config["testing"]["tests"]["a"]["enabled"] = False
         self.p1.save()
         out, err = self.check_cli(["tester", "-p", "QEMU", "--no-wait"])
         self.assertNotIn("Project: QEMU\n", out)
         self.cli_logout()
 
+        # The pending result was deleted
+        msg = Message.objects.all()[0]
+        self.assertFalse(msg.results.filter(name__startswith="testing.").exists())
+        self.assertIsNone(msg.get_summary().testing_status)
+
 
 # do not run tests on the abstract class
 del TestingTestCase
@@ -7,22 +7,32 @@
 #
 # This work is licensed under the MIT License.  Please see the LICENSE file or
 # http://opensource.org/licenses/MIT.
+import functools
 import urllib
 
+from django.core.cache import caches
 from django.shortcuts import render
 from django.http import HttpResponse, Http404
 from django.db.models import Exists, F, OuterRef
 from django.urls import reverse
+from django.template.loader import render_to_string
 from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from django.views.decorators.vary import vary_on_cookie
 from django.conf import settings
 from api.models import Project, Message
 import api
-from mod import dispatch_module_hook
+from mod import dispatch_module_hook, get_render_page_context
+from patchew.conditional import conditional_response
 from patchew.logviewer import LogView
 import subprocess
 
 PAGE_SIZE = 50
 
+# Anonymous series pages are cached for a short time even if the series does
+# not change, because the ages of the messages are part of the page
+SERIES_DETAIL_CACHE_TIMEOUT = 60
+
 
 def try_get_git_head():
     try:
@@ -34,8 +44,16 @@ def try_get_git_head():
         return ""
 
 
+@functools.lru_cache(maxsize=None)
+def get_patchew_version():
+    """Return the version shown in the footer of the pages.  It only changes
+    when Patchew is deployed, so it is computed once per process"""
+    return settings.VERSION + try_get_git_head()
+
+
 def render_page(request, template_name, **data):
-    data["patchew_version"] = settings.VERSION + try_get_git_head()
+    data = {**get_render_page_context(), **data}
+    data["patchew_version"] = get_patchew_version()
     dispatch_module_hook("render_page_hook", request=request, context_data=data)
     return render(request, template_name, context=data)
 
@@ -77,6 +95,22 @@ def prepare_message(request, project, m, for_message_view):
     return m
 
 
+def prepare_messages(request, project, messages, for_message_view):
+    """Prepare a page of messages, letting modules fetch the data that their
+    prepare_message_hook needs with a few queries for the whole page"""
+    messages = list(messages)
+    dispatch_module_hook(
+        "prepare_messages_hook",
+        request=request,
+        messages=messages,
+        for_message_view=for_message_view,
+    )
+    return [
+        prepare_message(request, project or m.project, m, for_message_view)
+        for m in messages
+    ]
+
+
 def prepare_patches(request, m, max_depth=None):
     if m.total_patches == 1:
         return []
@@ -85,19 +119,20 @@ def prepare_patches(request, m, max_depth=None):
         in_reply_to=OuterRef("message_id")
     )
     replies = replies.annotate(has_replies=Exists(commit_replies))
-    project = m.project
-    return [prepare_message(request, project, x, True) for x in replies]
+    return prepare_messages(request, m.project, replies, True)
 
 
 def prepare_series(request, s, skip_patches=False):
     r = []
     project = s.project
+    # @s can also be a patch, whose replies are in the thread of its series
+    head = s.get_series_head()
+    thread = head.get_thread_replies() if head else {}
 
     def add_msg_recurse(m, skip_patches, depth=0):
-        a = prepare_message(request, project, m, True)
-        a.indent_level = min(depth, 4)
-        r.append(a)
-        replies = m.get_replies()
+        m.indent_level = min(depth, 4)
+        r.append(m)
+        replies = thread.get(m.message_id, [])
         non_patches = [x for x in replies if not x.is_patch]
         patches = []
         if not skip_patches:
@@ -106,7 +141,7 @@ def prepare_series(request, s, skip_patches=False):
             add_msg_recurse(x, False, depth + 1)
 
     add_msg_recurse(s, skip_patches)
-    return r
+    return prepare_messages(request, project, r, True)
 
 
 def prepare_results(request, obj):
@@ -121,7 +156,33 @@ def prepare_results(request, obj):
 
 
 def prepare_series_list(request, sl):
-    return [prepare_message(request, s.project, s, False) for s in sl]
+    """Prepare the rows of a series list.  The parts of the rows that only
+    depend on the series are cached, keyed by the version of its summary,
+    and only the series that are not in the cache are prepared"""
+    sl = list(sl)
+    fragments = caches["fragments"]
+    # The rows also show the name of the project
+    keys = {
+        s.id: "series-row:%s:%d:%d" % (s.project.name, s.id, s.get_summary().version)
+        for s in sl
+    }
+    rows = fragments.get_many(keys.values())
+    missing = [s for s in sl if keys[s.id] not in rows]
+    rendered = {}
+    for s in prepare_messages(request, None, missing, False):
+        row_class = " ".join(
+            st["row_class"] for st in s.status_tags if st.get("row_class")
+        )
+        row_html = render_to_string("series-row.html", {"s": s})
+        rendered[keys[s.id]] = (row_class, row_html)
+    if rendered:
+        fragments.set_many(rendered)
+        rows.update(rendered)
+    for s in sl:
+        row_class, row_html = rows[keys[s.id]]
+        s.row_class = row_class
+        s.row_html = mark_safe(row_html)
+    return sl
 
 
 def prepare_projects():
@@ -224,7 +285,7 @@ def render_series_list_page(
     else:
         query = base_query.order_by("-date")
         order_by_reply = False
-    query = query.prefetch_related("topic", "results")
+    query = api.models.Message.objects.series_list(query)
     series = query[start : start + PAGE_SIZE]
     if not series and cur_page > 1:
         raise Http404("Page not found")
@@ -290,7 +351,7 @@ def view_search(request):
 
     search = request.GET.get("q", "").strip()
     se = SearchEngine([search], request.user)
-    query = se.search_series()
+    query = se.search_series(cached=True)
     return render_series_list_page(
         request,
         query,
@@ -321,16 +382,48 @@ def view_mbox(request, project, message_id):
     s = api.models.Message.objects.find_message(message_id, project)
     if not s:
         raise Http404("Series not found")
-    mbox = s.get_mbox_with_tags()
-    if not mbox:
-        raise Http404("Series not complete")
-    return HttpResponse(mbox, content_type="text/plain")
+
+    def make_response():
+        mbox = s.get_mbox_with_tags()
+        if not mbox:
+            raise Http404("Series not complete")
+        return HttpResponse(mbox, content_type="text/plain")
+
+    last_modified = None
+    if s.is_series_head:
+        last_modified = s.last_reply_date or s.date
+    return conditional_response(
+        request, make_response, etag=s.get_mbox_etag(), last_modified=last_modified
+    )
 
 
+@vary_on_cookie
 def view_series_detail(request, project, message_id):
     s = api.models.Message.objects.find_series(message_id, project)
     if not s:
         raise Http404("Series not found")
+    if request.user.is_authenticated:
+        return render_series_detail(request, project, s)
+
+    # The page is the same for all anonymous users; the whole response is
+    # cached so that its headers are preserved
+    def make_response():
+        fragments = caches["fragments"]
+        response = fragments.get(key)
+        if response is None:
+            response = render_series_detail(request, project, s)
+            # Do not share a page that includes this client's CSRF token
+            if not request.META.get("CSRF_COOKIE_USED"):
+                fragments.set(key, response, SERIES_DETAIL_CACHE_TIMEOUT)
+        return response
+
+    key = "series-detail:%s:%d:%d" % (project, s.id, s.get_summary().version)
+    # Weak, because the ages of the messages are part of the page
+    return conditional_response(request, make_response, etag='W/"%s"' % key)
+
+
+def render_series_detail(request, project, s):
+    message_id = s.message_id
     nav_path = prepare_navigate_list(
         "View series", ("series_list", {"project": project}, project)
     )
@@ -384,7 +477,7 @@ def view_series_message(request, project, thread_id, message_id):
         ("series_detail", {"project": project, "message_id": thread_id}, s.subject),
     )
     search = "id:" + thread_id
-    series = prepare_message(request, s.project, s, True)
+    series = prepare_messages(request, s.project, [s], True)[0]
     messages = prepare_series(request, m)
     mbox_url = reverse("mbox", kwargs={"project": project, "message_id": message_id})
     series.extra_links.append(